@@ -0,0 +1,380 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import cv2
+
+from stream import StreamPipeline, Gst, PROFILES, DEFAULT_PROFILE
+from metrics import Histogram, RateMeter
+from recorder import Recorder
+from camera_process import CameraProcess
+
+# every synthetic frame carries its sequence number and send time as a grid of black and white blocks
+BARCODE_BLOCK = 16
+BARCODE_COLUMNS = 16
+BARCODE_ROWS = 3
+BARCODE_BITS = np.arange(BARCODE_ROWS * BARCODE_COLUMNS, dtype=np.uint64)
+
+def now_us():
+    # CLOCK_MONOTONIC is shared by every process on the machine, so sender and receiver agree on it
+    return time.monotonic_ns() // 1000
+
+def draw_barcode(frame, sequence, timestamp):
+    value = np.uint64(((sequence & 0xFFFF) << 32) | (timestamp & 0xFFFFFFFF))
+    bits = ((value >> BARCODE_BITS) & np.uint64(1)).astype(np.uint8).reshape(BARCODE_ROWS, BARCODE_COLUMNS)
+    blocks = np.kron(bits * 255, np.ones((BARCODE_BLOCK, BARCODE_BLOCK), dtype=np.uint8))
+    frame[:blocks.shape[0], :blocks.shape[1]] = blocks[..., None]
+
+def read_barcode(frame):
+    centers = frame[BARCODE_BLOCK // 2::BARCODE_BLOCK, BARCODE_BLOCK // 2::BARCODE_BLOCK][:BARCODE_ROWS, :BARCODE_COLUMNS, :3]
+    bits = (centers.mean(axis=2) > 127).ravel().astype(np.uint64)
+    value = int((bits << BARCODE_BITS).sum())
+    return value >> 32, value & 0xFFFFFFFF
+
+def create_background(width, height):
+    # smooth noise is closer to underwater footage than a flat test pattern and keeps the encoder honest
+    noise = np.random.default_rng(0).integers(0, 256, (height // 8 + 1, width // 4 + 1, 3), dtype=np.uint8)
+    return cv2.resize(noise, (width * 2, height), interpolation=cv2.INTER_CUBIC)
+
+def run_sender(ports, width, height, frame_rate, codec, replay, stop_event):
+    pipelines = []
+    for port in ports:
+        if replay:
+            description = f"filesrc name=src ! pcapparse ! udpsink host=127.0.0.1 port={port} sync=true"
+        else:
+            encoder = (
+                f"x264enc tune=zerolatency speed-preset=ultrafast key-int-max={frame_rate} ! rtph264pay config-interval=1 pt=96"
+                if codec == "H264" else
+                "jpegenc ! rtpjpegpay"
+            )
+            description = (
+                f"appsrc name=src is-live=true format=time do-timestamp=true ! videoconvert ! {encoder} ! "
+                f"udpsink host=127.0.0.1 port={port} sync=false"
+            )
+
+        pipeline = Gst.parse_launch(description)
+        source = pipeline.get_by_name("src")
+        if replay:
+            source.set_property("location", replay)
+        else:
+            source.set_property("caps", Gst.Caps.from_string(f"video/x-raw,format=RGB,width={width},height={height},framerate={frame_rate}/1"))
+
+        pipeline.set_state(Gst.State.PLAYING)
+        pipelines.append(pipeline)
+
+    if replay:
+        stop_event.wait()
+    else:
+        background = create_background(width, height)
+        start = time.perf_counter()
+        for sequence in itertools.count():
+            if stop_event.is_set():
+                break
+
+            delay = start + sequence / frame_rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+            offset = (sequence * 4) % width
+            for pipeline in pipelines:
+                frame = background[:, offset:offset + width].copy()
+                draw_barcode(frame, sequence, now_us())
+                pipeline.get_by_name("src").emit("push-buffer", Gst.Buffer.new_wrapped(frame.tobytes()))
+
+    for pipeline in pipelines:
+        pipeline.set_state(Gst.State.NULL)
+
+class LatencyProbe():
+    def __init__(self):
+        self.latency = Histogram()
+        self.frames = 0
+        self.lost = 0
+        self.last_sequence = None
+
+    def measure(self, frame):
+        sequence, timestamp = read_barcode(frame)
+        latency = ((now_us() - timestamp) & 0xFFFFFFFF) / 1e6
+        if latency > 10:
+            # misread barcode, most likely a replayed stream without one
+            return None
+
+        self.latency.record(latency)
+        self.frames += 1
+        if self.last_sequence is not None and sequence != self.last_sequence:
+            gap = (sequence - self.last_sequence - 1) & 0xFFFF
+            # anything bigger is a misread rather than a real gap
+            if gap < 1000:
+                self.lost += gap
+        self.last_sequence = sequence
+
+        return latency
+
+    def reset(self):
+        self.latency.reset()
+        self.frames = 0
+        self.lost = 0
+
+class DisplayEmulator():
+    # does the same per frame work as CameraStream.update without needing a window
+    def __init__(self, streams, refresh_rate=60, scale=0.5):
+        self.streams = streams
+        self.refresh_rate = refresh_rate
+        self.scale = scale
+        self.probes = [LatencyProbe() for _ in streams]
+        self.skipped = [0 for _ in streams]
+        self.rates = [RateMeter() for _ in streams]
+        self.displayed = [0 for _ in streams]
+        self.buffers = {}
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stop_event.wait(1 / self.refresh_rate):
+            for i, stream in enumerate(self.streams):
+                sequence, frame = stream.latest_frame
+                if frame is None or sequence == self.displayed[i]:
+                    continue
+
+                self.skipped[i] += max(0, sequence - self.displayed[i] - 1)
+                self.displayed[i] = sequence
+                self.upload(i, frame)
+                self.rates[i].tick()
+                self.probes[i].measure(frame)
+
+    def upload(self, i, frame):
+        height, width, _ = frame.shape
+        dimensions = (max(1, int(width * self.scale)), max(1, int(height * self.scale)))
+        if self.buffers.get(i, (None,))[0] != dimensions:
+            self.buffers[i] = (
+                dimensions,
+                np.zeros((dimensions[1], dimensions[0], 4), dtype=np.uint8),
+                np.zeros((dimensions[1], dimensions[0], 4), dtype=np.float32),
+            )
+
+        _, resized, texture = self.buffers[i]
+        cv2.resize(frame, dimensions, dst=resized, interpolation=cv2.INTER_AREA)
+        np.multiply(resized, np.float32(1 / 255), out=texture, dtype=np.float32)
+
+    def reset(self):
+        for probe in self.probes:
+            probe.reset()
+        self.skipped = [0 for _ in self.streams]
+
+def get_rss_mb():
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        # peak rather than current on platforms without procfs, macOS reports bytes instead of KiB
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+def get_cpu_seconds():
+    # only this process, which leaves out the sender, camera workers are added from get_worker_usage
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def get_worker_usage(streams):
+    # (cpu seconds, rss MB) summed over camera worker processes, read from procfs where there is one
+    cpu = 0.0
+    rss = 0.0
+    for stream in streams:
+        process = getattr(stream, "process", None)
+        if process is None or process.pid is None:
+            continue
+
+        try:
+            with open(f"/proc/{process.pid}/stat") as file:
+                # the command name can contain spaces, the fields after it can't
+                fields = file.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{process.pid}/statm") as file:
+                pages = int(file.read().split()[1])
+        except (OSError, IndexError):
+            continue
+
+        # utime and stime are fields 14 and 15, the slice starts at field 3
+        cpu += (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        rss += pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+    return cpu, rss
+
+def summarize(histogram):
+    return {
+        "p50_ms": 1000 * histogram.percentile(50),
+        "p99_ms": 1000 * histogram.percentile(99),
+        "mean_ms": 1000 * histogram.mean(),
+        "max_ms": 1000 * histogram.max,
+        "samples": histogram.count,
+    }
+
+def run_benchmark(width, height, frame_rate, cameras, recording, duration, warmup, profile=DEFAULT_PROFILE, replay=None,
+                  base_port=5700, processes=False, preroll_seconds=0, preroll_megabytes=256):
+    ports = [base_port + i for i in range(cameras)]
+    streams = [(CameraProcess if processes else StreamPipeline)(port, profile) for port in ports]
+
+    # the same pre-roll as the client, recordings of a stream that has one are written from it
+    if preroll_seconds > 0:
+        for stream in streams:
+            stream.enable_preroll(preroll_seconds, int(preroll_megabytes * 2 ** 20))
+
+    probes = [LatencyProbe() for _ in streams]
+    for stream, probe in zip(streams, probes):
+        stream.add_callback(probe.measure, policy="queue", max_frames=8)
+
+    display = DisplayEmulator(streams)
+    display.thread.start()
+
+    recording_dir = tempfile.TemporaryDirectory(prefix="benchmark-")
+    recorders = []
+    if recording:
+        for i, stream in enumerate(streams):
+            recorder = Recorder(stream, os.path.join(recording_dir.name, f"camera_{i}.avi"), frame_rate=frame_rate)
+            recorder.start()
+            recorders.append(recorder)
+
+    context = multiprocessing.get_context("spawn")
+    stop_event = context.Event()
+    sender = context.Process(target=run_sender, args=(ports, width, height, frame_rate, PROFILES[profile]["codec"], replay, stop_event), daemon=True)
+    sender.start()
+
+    time.sleep(warmup)
+
+    for stream in streams:
+        for histogram in stream.metrics.histograms.values():
+            histogram.reset()
+    for probe in probes:
+        probe.reset()
+    display.reset()
+    subscriber_drops = [sum(s["dropped"] for s in stream.get_subscriber_stats()) for stream in streams]
+    received = [stream.latest_frame[0] for stream in streams]
+
+    cpu_start = get_cpu_seconds()
+    worker_cpu_start, _ = get_worker_usage(streams)
+    wall_start = time.perf_counter()
+    time.sleep(duration)
+    wall = time.perf_counter() - wall_start
+    worker_cpu, worker_rss = get_worker_usage(streams)
+    worker_cpu -= worker_cpu_start
+    cpu = get_cpu_seconds() - cpu_start + worker_cpu
+    rss = get_rss_mb() + worker_rss
+
+    results = []
+    for i, stream in enumerate(streams):
+        stats = stream.get_subscriber_stats()
+        result = {
+            "port": ports[i],
+            "received_fps": (stream.latest_frame[0] - received[i]) / wall,
+            "displayed_fps": display.rates[i].get_rate(),
+            "subscriber_latency": summarize(probes[i].latency),
+            "display_latency": summarize(display.probes[i].latency),
+            "lost_frames": probes[i].lost,
+            "display_skipped_frames": display.skipped[i],
+            "subscriber_dropped_frames": sum(s["dropped"] for s in stats) - subscriber_drops[i],
+        }
+        if processes:
+            # the pipeline histograms live in the worker, it only sends their rows over
+            result["worker_metrics"] = stream.metrics.remote_rows
+            result["shared_frame_copy"] = summarize(stream.copy_time)
+            result["worker_restarts"] = stream.restarts
+        else:
+            result["pipeline_latency"] = summarize(stream.pipeline_latency)
+            result["decode_latency"] = summarize(stream.decode_latency)
+            result["appsink_callback"] = summarize(stream.sample_time)
+        results.append(result)
+
+    stop_event.set()
+    sender.join(5)
+    display.stop_event.set()
+    for recorder in recorders:
+        recorder.stop()
+        recorder.wait(10)
+    for stream in streams:
+        stream.close()
+    recording_dir.cleanup()
+
+    return {
+        "width": width,
+        "height": height,
+        "frame_rate": frame_rate,
+        "cameras": cameras,
+        "recording": recording,
+        "profile": profile,
+        "processes": processes,
+        "preroll_seconds": preroll_seconds,
+        "replay": replay,
+        "duration_s": wall,
+        "cpu_percent": 100 * cpu / wall,
+        "rss_mb": rss,
+        "worker_cpu_percent": 100 * worker_cpu / wall,
+        "worker_rss_mb": worker_rss,
+        "streams": results,
+    }
+
+def parse_resolution(resolution):
+    width, height = resolution.lower().split("x")
+    return int(width), int(height)
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless synthetic load benchmark for the camera frame path")
+    parser.add_argument("--resolutions", default="640x480,1280x720,1920x1080")
+    parser.add_argument("--frame-rates", default="30,60")
+    parser.add_argument("--cameras", default="1,2")
+    parser.add_argument("--recording", choices=("off", "on", "both"), default="both")
+    parser.add_argument("--processes", action="store_true", help="run every camera pipeline in its own worker process")
+    parser.add_argument("--profiles", default=DEFAULT_PROFILE, help=f"comma separated, any of {', '.join(PROFILES)}")
+    parser.add_argument("--replay", help="replay a captured pcap of the RTP stream instead of generating one")
+    parser.add_argument("--preroll-seconds", type=float, default=float(os.environ.get("MATE_PREROLL_SECONDS", 30)), help="0 disables it, like the client")
+    parser.add_argument("--preroll-mb", type=float, default=float(os.environ.get("MATE_PREROLL_MB", 256)))
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--base-port", type=int, default=5700)
+    parser.add_argument("--output", default="benchmark/report.json")
+    args = parser.parse_args()
+
+    recording = {"off": [False], "on": [True], "both": [False, True]}[args.recording]
+    runs = list(itertools.product(
+        [parse_resolution(r) for r in args.resolutions.split(",")],
+        [int(f) for f in args.frame_rates.split(",")],
+        [int(c) for c in args.cameras.split(",")],
+        recording,
+        args.profiles.split(","),
+    ))
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "gstreamer": Gst.version_string(),
+        "runs": [],
+    }
+
+    for (width, height), frame_rate, cameras, record, profile in runs:
+        print(f"{width}x{height}@{frame_rate} x{cameras} recording={record} profile={profile}", flush=True)
+        result = run_benchmark(width, height, frame_rate, cameras, record, args.duration, args.warmup, profile, args.replay,
+                               args.base_port, args.processes, args.preroll_seconds, args.preroll_mb)
+        report["runs"].append(result)
+
+        for stream in result["streams"]:
+            print(
+                f"  port {stream['port']}: {stream['received_fps']:.1f} fps, "
+                f"latency p50 {stream['display_latency']['p50_ms']:.1f} ms p99 {stream['display_latency']['p99_ms']:.1f} ms, "
+                f"lost {stream['lost_frames']}, cpu {result['cpu_percent']:.0f}%, rss {result['rss_mb']:.0f} MB",
+                flush=True
+            )
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+
+    print(f"Wrote {args.output}")
+
+if __name__ == "__main__":
+    main()
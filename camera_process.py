@@ -0,0 +1,275 @@
+import multiprocessing
+import threading
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+from metrics import Metrics
+from stream import FrameSource, StreamPipeline, PROFILES, DEFAULT_PROFILE
+
+class FrameRing():
+    # one header row per slot holding (sequence, width, height, timestamp), row 0 holds the latest sequence written
+    header_columns = 8
+
+    def __init__(self, name=None, slots=4, max_width=1920, max_height=1080):
+        self.slots = slots
+        self.max_width = max_width
+        self.max_height = max_height
+        self.slot_size = max_width * max_height * 4
+        header_size = (slots + 1) * self.header_columns * 8
+
+        create = name is None
+        self.memory = shared_memory.SharedMemory(name=name, create=create, size=header_size + slots * self.slot_size)
+        self.header = np.ndarray((slots + 1, self.header_columns), dtype=np.int64, buffer=self.memory.buf)
+        self.data = np.ndarray((slots, self.slot_size), dtype=np.uint8, buffer=self.memory.buf, offset=header_size)
+        if create:
+            self.header[:] = 0
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def write(self, frame, timestamp=None):
+        height, width, _ = frame.shape
+        if frame.nbytes > self.slot_size:
+            raise ValueError(f"{width}x{height} frame doesn't fit a {self.max_width}x{self.max_height} slot")
+
+        # the latest sequence survives a worker restart, so sequences keep counting up for the readers
+        sequence = int(self.header[0, 0]) + 1
+        slot = sequence % self.slots
+        row = self.header[slot + 1]
+
+        # readers treat a slot without its sequence as being written
+        row[0] = -1
+        self.data[slot, :frame.nbytes].reshape(frame.shape)[:] = frame
+        row[1] = width
+        row[2] = height
+        row[3] = -1 if timestamp is None else timestamp
+        row[0] = sequence
+        self.header[0, 0] = sequence
+
+        return sequence
+
+    def read(self, sequence):
+        slot = sequence % self.slots
+        row = self.header[slot + 1]
+        if row[0] != sequence:
+            return None
+
+        width, height = int(row[1]), int(row[2])
+        frame = self.data[slot, :width * height * 4].reshape(height, width, 4)
+        frame.flags.writeable = False
+        return frame
+
+    def get_timestamp(self, sequence):
+        timestamp = int(self.header[sequence % self.slots + 1, 3])
+        return None if timestamp < 0 else timestamp
+
+    def is_current(self, sequence):
+        # the writer may have lapped a reader that held on to a slot for too long
+        return self.header[sequence % self.slots + 1, 0] == sequence
+
+    def close(self, unlink=False):
+        self.header = None
+        self.data = None
+        try:
+            self.memory.close()
+        except BufferError:
+            # a frame view is still alive somewhere, the mapping goes away with the process instead
+            pass
+
+        if unlink:
+            self.memory.unlink()
+
+class WorkerPipeline(StreamPipeline):
+    def __init__(self, port, profile, ring, events):
+        self.ring = ring
+        self.events = events
+        self.events_lock = threading.Lock()
+        self.oversized = 0
+        super().__init__(port, profile)
+        self.metrics.add_counter("oversized frames", lambda: self.oversized)
+
+    def deliver(self, mapped, timestamp=None):
+        # straight from the mapped GStreamer buffer into shared memory, the only copy a frame gets
+        try:
+            sequence = self.ring.write(mapped, timestamp)
+        except ValueError as e:
+            # an exception here would end the pull thread and leave the worker running without video
+            if self.oversized == 0:
+                print(f"Camera {self.port} dropping frames: {e}")
+            self.oversized += 1
+            return
+
+        self.send(("frame", sequence))
+
+    def send(self, message):
+        with self.events_lock:
+            self.events.send(message)
+
+def run_camera_worker(port, profile, ring_name, slots, max_width, max_height, commands, events):
+    ring = FrameRing(ring_name, slots, max_width, max_height)
+    pipeline = WorkerPipeline(port, profile, ring, events)
+
+    try:
+        while True:
+            if commands.poll(1.0):
+                command, *args = commands.recv()
+                if command == "stop":
+                    break
+                elif command == "set_profile":
+                    pipeline.set_profile(*args)
+
+            pipeline.send(("metrics", pipeline.metrics.get_rows()))
+    except (EOFError, OSError):
+        # the UI process went away
+        pass
+    finally:
+        pipeline.close()
+        ring.close()
+
+class ProcessMetrics(Metrics):
+    def __init__(self, name):
+        super().__init__(name)
+        # the worker's own rows, replaced as a whole whenever it sends new ones
+        self.remote_rows = []
+
+    def get_rows(self):
+        return list(self.remote_rows) + super().get_rows()
+
+class CameraProcess(FrameSource):
+    shared_frames = True
+
+    def __init__(self, port = 5601, profile=DEFAULT_PROFILE, slots=4, max_width=1920, max_height=1080):
+        super().__init__(port, ProcessMetrics(f"Camera {port}"))
+        self.profile = profile
+        self.copy_time = self.metrics.histogram("shared frame copy")
+        self.restarts = 0
+        self.metrics.add_counter("worker restarts", lambda: self.restarts)
+
+        self.ring = FrameRing(None, slots, max_width, max_height)
+        self.context = multiprocessing.get_context("spawn")
+        self.lock = threading.Lock()
+        self.closing = threading.Event()
+
+        self.process = None
+        self.commands = None
+        self.events = None
+        self.start_process()
+
+        self.thread = threading.Thread(target=self.supervise, daemon=True)
+        self.thread.start()
+
+    def start_process(self):
+        commands, worker_commands = self.context.Pipe()
+        events, worker_events = self.context.Pipe(duplex=False)
+
+        with self.lock:
+            if self.closing.is_set():
+                return False
+
+            self.process = self.context.Process(
+                target=run_camera_worker,
+                args=(self.port, self.profile, self.ring.name, self.ring.slots, self.ring.max_width, self.ring.max_height, worker_commands, worker_events),
+                name=f"camera-{self.port}",
+                daemon=True
+            )
+            self.process.start()
+            self.commands = commands
+            self.events = events
+
+        # drop our copies of the worker's ends so a crash shows up as EOF
+        worker_commands.close()
+        worker_events.close()
+        return True
+
+    def supervise(self):
+        backoff = 1
+        while True:
+            started = time.monotonic()
+            self.receive_events(self.events)
+            if self.closing.is_set():
+                break
+
+            self.process.join(1)
+            print(f"Camera {self.port} worker exited with code {self.process.exitcode}, restarting")
+
+            # only back off further if the worker keeps dying straight away
+            if time.monotonic() - started > 30:
+                backoff = 1
+            if self.closing.wait(backoff):
+                break
+            backoff = min(backoff * 2, 10)
+
+            if not self.start_process():
+                break
+            self.restarts += 1
+
+    def receive_events(self, events):
+        while True:
+            try:
+                kind, value = events.recv()
+            except (EOFError, OSError):
+                return
+
+            if kind == "frame":
+                self.on_frame(value)
+            elif kind == "metrics":
+                self.metrics.remote_rows = value
+
+    def is_frame_current(self, sequence):
+        return self.ring.is_current(sequence)
+
+    def on_frame(self, sequence):
+        frame = self.ring.read(sequence)
+        if frame is None:
+            # already overwritten, we've fallen more than a ring behind
+            return
+
+        # the display only reads the newest frame, so it gets the shared memory view without a copy
+        self.set_latest_frame(sequence, frame)
+
+        if self.frame_bus.subscribers:
+            # subscribers can queue frames for longer than a slot lives, they get their own copy
+            start = time.perf_counter()
+            copy = frame.copy()
+            timestamp = self.ring.get_timestamp(sequence)
+            if not self.ring.is_current(sequence):
+                return
+            copy.flags.writeable = False
+            self.frame_bus.publish(copy, timestamp)
+            self.copy_time.record(time.perf_counter() - start)
+
+    def send_command(self, *command):
+        with self.lock:
+            try:
+                self.commands.send(command)
+            except OSError:
+                # the worker is down, the supervisor restarts it with the current settings
+                pass
+
+    def set_profile(self, profile):
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown pipeline profile {profile}")
+
+        for callback in list(self.rebuild_callbacks):
+            callback()
+
+        self.profile = profile
+        self.update_preroll()
+        self.send_command("set_profile", profile)
+
+    def close(self):
+        with self.lock:
+            self.closing.set()
+
+        self.send_command("stop")
+        self.process.join(2)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.thread.join(2)
+
+        self.frame_bus.close()
+        self.latest_frame = (self.latest_frame[0], None)
+        self.ring.close(unlink=True)
@@ -1,299 +1,599 @@
-import gi
-gi.require_version('Gst', '1.0')
-from gi.repository import Gst
-Gst.init(None)
-
-import re
-import cairo
-import pandas as pd
-import numpy as np
-import ctypes
-import cv2
+import concurrent.futures
+import csv
 import os
 import shutil
-import dearpygui.dearpygui as dpg
+import threading
+import time
+
+from startup import StartupTrace
+
+# everything up to the first frames on screen goes through this, it's printed once all panels are built
+trace = StartupTrace()
+
+with trace.span("import numpy"):
+    import numpy as np
+with trace.span("import cv2"):
+    import cv2
+with trace.span("import dearpygui"):
+    import dearpygui.dearpygui as dpg
+with trace.span("import stream (GStreamer)"):
+    from stream import StreamPipeline, PROFILES
+with trace.span("import app modules"):
+    from camera_process import CameraProcess
+    from recorder import Recorder, PassthroughRecorder, find_recording
+    from extraction import IMAGE_FORMATS, extract_frames, list_frames
+    from keyframes import extract_keyframes
+    from jobs import JobExecutor
+    from reconstruction import create_backend
+    from panorama import LiveStitcher, blend_panorama
+    from sync_capture import SyncCapture
+    from metrics import Metrics, write_csv
+    from scheduler import Scheduler
+
+# mate.ini finds windows by uuid, these are the ones the checked-in layout was saved with
+LAYOUT_WINDOWS = {"camera 5600": 34, "camera 5601": 38, "Photogrammetry": 40, "Photosphere": 52, "Carp": 59, "Notes": 65}
+
+def reserve_layout_windows():
+    # uuids are handed out in order, so taking them before anything else exists keeps the saved layout valid
+    # however many items are created before its windows, a layout that is already taken gets fresh ones
+    windows = {}
+    uuid = dpg.generate_uuid()
+    for name, window in sorted(LAYOUT_WINDOWS.items(), key=lambda item: item[1]):
+        while uuid < window:
+            uuid = dpg.generate_uuid()
+        windows[name] = window if uuid == window else dpg.generate_uuid()
+        uuid = dpg.generate_uuid()
+    return windows
+
+def setup_dearpygui():
+    dpg.create_context()
+    layout_windows = reserve_layout_windows()
+
+    with dpg.font_registry():
+        default_font = dpg.add_font("JetBrainsMonoNerdFont-Regular.ttf", 28)
+        dpg.bind_font(default_font)
+
+    dpg.set_global_font_scale(0.5)
+
+    dpg.configure_app(docking=True, docking_space=True, init_file="mate.ini")
+    dpg.create_viewport(title='MATE Client', width=1280, height=720)
+
+    with dpg.theme() as theme:
+        with dpg.theme_component(dpg.mvAll):
+            dpg.add_theme_style(dpg.mvStyleVar_WindowRounding, 4)
+            dpg.add_theme_style(dpg.mvStyleVar_FrameRounding, 2)
+            dpg.add_theme_style(dpg.mvStyleVar_GrabRounding, 2)
+            dpg.add_theme_style(dpg.mvStyleVar_TabRounding, 4)
+            dpg.add_theme_style(dpg.mvStyleVar_FramePadding, 4, 4)
+            dpg.add_theme_style(dpg.mvStyleVar_WindowTitleAlign, 0.5, 0.5)
+    dpg.bind_theme(theme)
+
+    return layout_windows
+
+class ExtractionSettings():
+    def __init__(self):
+        self.image_format = "PNG"
+        self.level = IMAGE_FORMATS[self.image_format][4]
+        self.select_keyframes = False
+        self.target_overlap = 0.7
+
+        with dpg.group(horizontal=True):
+            dpg.add_combo(list(IMAGE_FORMATS), label="Format", default_value=self.image_format, width=80, callback=self.set_image_format)
+            self.level_slider = dpg.add_slider_int(label="Compression", default_value=self.level, min_value=0, max_value=9, callback=self.set_level)
+
+        with dpg.group(horizontal=True):
+            dpg.add_checkbox(label="Smart Frame Selection", default_value=self.select_keyframes, callback=self.set_select_keyframes)
+            dpg.add_slider_float(label="Target Overlap", default_value=self.target_overlap, min_value=0.5, max_value=0.95, format="%.2f", callback=self.set_target_overlap)
+
+    def set_image_format(self, _, image_format):
+        _, _, min_level, max_level, default_level = IMAGE_FORMATS[image_format]
+        self.image_format = image_format
+        self.level = default_level
+
+        dpg.configure_item(
+            self.level_slider,
+            label="Quality" if image_format == "JPEG" else "Compression",
+            min_value=min_level,
+            max_value=max_level
+        )
+        dpg.set_value(self.level_slider, default_level)
+
+    def set_level(self, _, level):
+        self.level = level
+
+    def set_select_keyframes(self, _, select_keyframes):
+        self.select_keyframes = select_keyframes
+
+    def set_target_overlap(self, _, target_overlap):
+        self.target_overlap = target_overlap
+
+    def extract(self, path, output_dir, frame_rate, progress=None, executor=None):
+        # keyframe selection replaces the fixed frame rate stride
+        if self.select_keyframes:
+            return extract_keyframes(
+                path,
+                output_dir,
+                target_overlap=self.target_overlap,
+                image_format=self.image_format,
+                level=self.level,
+                progress=progress,
+                executor=executor
+            )
+
+        return extract_frames(
+            path,
+            output_dir,
+            frame_rate=frame_rate,
+            image_format=self.image_format,
+            level=self.level,
+            progress=progress,
+            executor=executor
+        )
 
-dpg.create_context()
+class JobStatus():
+    def __init__(self):
+        self.job = None
+        self.progress = None
 
-with dpg.font_registry():
-    default_font = dpg.add_font("JetBrainsMonoNerdFont-Regular.ttf", 28)
-    dpg.bind_font(default_font)
+        with dpg.group(horizontal=True, show=False) as self.group:
+            self.progress_bar = dpg.add_progress_bar(default_value=0.0)
+            self.cancel_button = dpg.add_button(label="Cancel", callback=self.on_cancel_button)
 
-dpg.set_global_font_scale(0.5)
+    def set_job(self, job):
+        self.job = job
+        self.progress = None
+        dpg.show_item(self.group)
+        dpg.show_item(self.cancel_button)
 
-dpg.configure_app(docking=True, docking_space=True, init_file="mate.ini")
-dpg.create_viewport(title='MATE Client', width=1280, height=720)
+    def is_busy(self):
+        return self.job is not None and self.job.is_running()
 
-with dpg.theme() as theme:
-    with dpg.theme_component(dpg.mvAll):
-        dpg.add_theme_style(dpg.mvStyleVar_WindowRounding, 4)
-        dpg.add_theme_style(dpg.mvStyleVar_FrameRounding, 2)
-        dpg.add_theme_style(dpg.mvStyleVar_GrabRounding, 2)
-        dpg.add_theme_style(dpg.mvStyleVar_TabRounding, 4)
-        dpg.add_theme_style(dpg.mvStyleVar_FramePadding, 4, 4)
-        dpg.add_theme_style(dpg.mvStyleVar_WindowTitleAlign, 0.5, 0.5)
-dpg.bind_theme(theme)
+    def on_cancel_button(self, _):
+        if self.job is not None:
+            self.job.cancel()
+
+    def update(self):
+        if self.job is None:
+            return
+
+        # jobs replace their progress tuple on every report, so this is cheap to poll every frame
+        progress = self.job.progress
+        if progress is self.progress:
+            return
+
+        self.progress = progress
+        dpg.set_value(self.progress_bar, progress.fraction)
+        dpg.configure_item(self.progress_bar, overlay=f"{progress.message} {100 * progress.fraction:.0f}%")
+
+        if self.job.is_done():
+            dpg.hide_item(self.cancel_button)
+
+def save_recording(job, recorder):
+    while not recorder.wait(0.1):
+        job.report(message="Saving recording")
+
+def read_capture_frames(capture_dir, port):
+    # one camera's frames of a synchronized capture, in capture order
+    with open(os.path.join(capture_dir, "index.csv"), newline="") as file:
+        return [os.path.join(capture_dir, row["path"]) for row in csv.DictReader(file) if int(row["camera"]) == port]
+
+def copy_frames(job, source_dir, output_dir):
+    # synchronized captures are already frames, they only have to be moved next to the model
+    paths = list_frames(source_dir)
+    for i, path in enumerate(paths):
+        shutil.copy(path, output_dir)
+        job.report((i + 1) / len(paths), "Copying frames")
 
 class Photosphere():
-    def __init__(self, camera):
-        camera.add_callback(self.on_new_frame)
-        self.recording = []
-        self.is_recording = False
-        self.is_writing = False
+    # frames a second fed to the live stitcher, a sweep overlaps plenty at this rate
+    live_frame_rate = 2
+    preview_size = (1024, 512)
+
+    def __init__(self, camera, jobs, window=0, cameras=None):
+        self.camera = camera
+        self.cameras = cameras or [camera]
+        self.jobs = jobs
+        self.recorder = None
+        self.capture = None
+        self.synchronized = False
+        # the only way an H.264 stream's pre-roll makes it into the recording
+        self.passthrough = True
         self.frame_rate = 30
-        self.is_reading = False
+        self.live_stitching = True
+        self.stitcher = None
+        self.stitch_lock = threading.Lock()
+        self.next_stitch_time = 0
+        self.stitch_subscriber = None
+        self.preview_state = (None, 0)
+
+        width, height = self.preview_size
+        self.preview_data = np.zeros((height, width, 4), dtype=np.float32)
+        with dpg.texture_registry():
+            self.preview_texture_id = dpg.add_raw_texture(
+                width=width,
+                height=height,
+                default_value=self.preview_data,
+                format=dpg.mvFormat_Float_rgba
+            )
 
-        with dpg.window(label="Photosphere"):
+        with dpg.window(label="Photosphere", tag=window):
             dpg.add_slider_int(label="Frame Rate", default_value=self.frame_rate, min_value=1, max_value=30, callback=self.set_frame_rate)
+            dpg.add_checkbox(label="Passthrough H.264", default_value=self.passthrough, callback=self.set_passthrough)
+            dpg.add_checkbox(label="Live Stitching", default_value=self.live_stitching, callback=self.set_live_stitching)
+            if len(self.cameras) > 1:
+                dpg.add_checkbox(label="Synchronized capture (all cameras)", default_value=self.synchronized, callback=self.set_synchronized)
             self.recording_button = dpg.add_button(label="Start Recording", callback=self.on_recording_button)
+            self.capture_info = dpg.add_text("", show=len(self.cameras) > 1)
+            self.save_status = JobStatus()
+            dpg.add_image(self.preview_texture_id, width=width // 2, height=height // 2)
+            self.stitch_info = dpg.add_text("No frames stitched")
             dpg.add_separator()
+            self.extraction_settings = ExtractionSettings()
             self.stitch_button = dpg.add_button(label="Stitch", callback=self.on_stitch_button)
+            dpg.add_separator()
+            self.stitch_status = JobStatus()
     
     def set_frame_rate(self, _, rate):
         self.frame_rate = rate
 
-    def on_recording_button(self, _):
-        if self.is_writing:
+    def set_passthrough(self, _, passthrough):
+        self.passthrough = passthrough
+
+    def set_live_stitching(self, _, live_stitching):
+        self.live_stitching = live_stitching
+
+    def set_synchronized(self, _, synchronized):
+        self.synchronized = synchronized
+
+    def start_live_stitching(self):
+        if os.path.exists("photosphere/live"):
+            shutil.rmtree("photosphere/live")
+        os.makedirs("photosphere/live", exist_ok=True)
+
+        self.stitcher = LiveStitcher(self.jobs.get_process_pool(), "photosphere/live", self.preview_size)
+        if self.capture is not None:
+            # the capture already writes every set, the stitcher takes them from there
+            self.next_stitch_time = 0
+            self.capture.on_set = self.on_capture_set
+            self.capture.on_close = self.stitcher.finish
             return
 
-        self.is_recording = not self.is_recording
-        if not self.is_recording:
-            dpg.configure_item(self.recording_button, label="Saving recording...")
-            self.is_writing = True
+        self.stitch_subscriber = self.camera.add_callback(
+            self.stitcher.on_camera_frame,
+            policy="queue",
+            max_frames=4,
+            frame_rate=self.live_frame_rate
+        )
+        # queued frames are still stitched after recording stops, the stitcher finishes once they're done
+        self.stitch_subscriber.on_close = self.stitcher.finish
 
-            if os.path.exists("photosphere/recording"):
-                shutil.rmtree("photosphere/recording")
-            os.makedirs("photosphere/recording", exist_ok=True)
+    def on_capture_set(self, frames):
+        # the other cameras look elsewhere, interleaving them would break every consecutive pair of the sweep
+        path, frame = frames[self.cameras.index(self.camera)]
 
-            video_writer = cv2.VideoWriter("photosphere/recording/video.avi", cv2.VideoWriter_fourcc(*"MJPG"), 30, (1920, 1080))
-            for frame in self.recording:
-                video_writer.write(frame)
-            video_writer.release()
+        # sets are written from every camera's thread, and a sweep overlaps plenty at the live rate
+        with self.stitch_lock:
+            now = time.monotonic()
+            if now < self.next_stitch_time:
+                return
+            self.next_stitch_time = now + 1 / self.live_frame_rate
 
-            self.is_writing = False
-            dpg.configure_item(self.recording_button, label="Start Recording")
+            self.stitcher.add_frame(frame, path)
 
+    def on_recording_button(self, _):
+        if self.recorder is None:
+            # stitching may still be reading the last recording
+            if self.stitch_status.is_busy():
+                return
+
+            for directory in ("photosphere/recording", "photosphere/capture"):
+                if os.path.exists(directory):
+                    shutil.rmtree(directory)
+            os.makedirs("photosphere/recording", exist_ok=True)
 
-            # for i, frame in enumerate(self.recording):
-            #     cv2.imwrite(f"photosphere/recording/frame_{i + 1}.png", frame)
-            
-            self.is_writing = False
-            self.recording = []
+            self.capture = None
+            if self.synchronized and len(self.cameras) > 1:
+                self.recorder = self.capture = SyncCapture(self.cameras, "photosphere/capture", frame_rate=self.frame_rate)
+            elif self.passthrough and self.camera.supports_passthrough():
+                self.recorder = PassthroughRecorder(self.camera, "photosphere/recording/video.mkv")
+            else:
+                self.recorder = Recorder(self.camera, "photosphere/recording/video.avi", frame_rate=self.frame_rate)
+            self.recorder.start()
+            if self.live_stitching:
+                self.start_live_stitching()
+            dpg.configure_item(self.recording_button, label="Recording...")
+        elif self.recorder.is_recording():
+            self.recorder.stop()
+            if self.stitch_subscriber is not None:
+                self.camera.remove_callback(self.stitch_subscriber)
+                self.stitch_subscriber = None
+            self.save_status.set_job(self.jobs.submit("Saving recording", save_recording, self.recorder))
+            dpg.configure_item(self.recording_button, label="Saving recording...")
 
+    def update(self):
+        if self.recorder is not None and self.recorder.is_finished():
+            self.recorder = None
             dpg.configure_item(self.recording_button, label="Start Recording")
-        else:
-            dpg.configure_item(self.recording_button, label="Recording...")
-    
-    def on_stitch_button(self, _):
-        if self.is_reading:
-            return
-        
-        os.makedirs("photosphere", exist_ok=True)
 
-        if os.path.exists("photosphere/stitch"):
-            shutil.rmtree("photosphere/stitch")
+        if self.capture is not None:
+            dpg.set_value(self.capture_info, self.capture.get_summary())
 
-        os.makedirs("photosphere/stitch", exist_ok=True)
+        stitcher = self.stitcher
+        if stitcher is not None and (stitcher, stitcher.preview_version) != self.preview_state:
+            self.preview_state = (stitcher, stitcher.preview_version)
+            np.multiply(stitcher.preview, np.float32(1 / 255), out=self.preview_data, dtype=np.float32)
+            dpg.set_value(self.preview_texture_id, self.preview_data)
+            dpg.set_value(self.stitch_info, f"{len(stitcher.frames)} frames stitched, {stitcher.gaps} gaps")
 
-        self.is_reading = True
+        self.save_status.update()
+        self.stitch_status.update()
 
-        dpg.configure_item(self.stitch_button, label="Setting up")
-        video_capture = cv2.VideoCapture("photosphere/recording/video.avi")
-        # read all frames
-        skip_frames = max(1, 30 // self.frame_rate)
-        frame_count = 0
-        while True:
-            ret, frame = video_capture.read()
-            if not ret:
-                break
+    def on_stitch_button(self, _):
+        # a second stitch would clear the frames the first is still blending, an unsaved recording can't be read yet
+        if self.stitch_status.is_busy() or self.save_status.is_busy():
+            return
 
-            if frame_count % skip_frames == 0:
-                cv2.imwrite(f"photosphere/stitch/frame_{frame_count // skip_frames + 1}.png", frame)
-            
-            frame_count += 1
-        video_capture.release()
+        self.stitch_status.set_job(self.jobs.submit("Stitching", self.stitch))
 
-        self.is_reading = False
-        
-        # os.system("/Applications/PTGui.app/Contents/MacOS/PTGui -createproject photosphere/stitch/*.png -output photosphere/stitch/project.pts")
-        # os.system("/Applications/PTGui.app/Contents/MacOS/PTGui photosphere/stitch/project.pts")
+    def stitch(self, job):
+        os.makedirs("photosphere", exist_ok=True)
 
-        dpg.configure_item(self.stitch_button, label = "Stitch")
+        stitcher = self.stitcher
+        if stitcher is None or (stitcher.wait(0) and not stitcher.frames):
+            stitcher = self.stitch_recording(job)
 
-    def on_new_frame(self, frame):
-        if self.is_recording:
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
-            self.recording.append(frame)
-        
+        # a live stitch may still be working through the last frames of the recording
+        while not stitcher.wait(0.1):
+            job.report(0.5, "Waiting for live stitching")
 
-class Photogrammetry():
-    lib = ctypes.cdll.LoadLibrary("libpgm.dylib")
+        blend_panorama(stitcher.frames, "photosphere/panorama.jpg", progress=job.reporter("Blending", 0.5, 1.0))
+
+    def stitch_recording(self, job):
+        # nothing was stitched live, register the extracted frames of the last recording instead
+        if os.path.exists("photosphere/stitch"):
+            shutil.rmtree("photosphere/stitch")
 
-    lib.run_photogrammetry_session.arg_types = [ctypes.c_char_p]
-    lib.run_photogrammetry_session.restype = None
+        os.makedirs("photosphere/stitch", exist_ok=True)
 
-    lib.is_completed.argtypes = []
-    lib.is_completed.restype = ctypes.c_bool
+        if self.capture is not None:
+            paths = read_capture_frames("photosphere/capture", self.camera.port)
+        else:
+            self.extraction_settings.extract(
+                find_recording("photosphere/recording"),
+                "photosphere/stitch",
+                self.frame_rate,
+                progress=job.reporter("Extracting", 0.0, 0.25),
+                executor=job.process_pool
+            )
+            paths = list_frames("photosphere/stitch")
 
-    lib.get_progress.argtypes = []
-    lib.get_progress.restype = ctypes.c_double
+        self.stitcher = LiveStitcher(job.process_pool, "photosphere/stitch", self.preview_size)
+        report = job.reporter("Registering", 0.25, 0.5)
+        try:
+            for i, path in enumerate(paths):
+                self.stitcher.add_frame(cv2.imread(path), path)
+                report((i + 1) / len(paths))
+        finally:
+            self.stitcher.finish()
 
-    lib.get_eta.argtypes = []
-    lib.get_eta.restype = ctypes.c_double
+        return self.stitcher
 
-    lib.stop_photogrammetry_session.argtypes = []
-    lib.stop_photogrammetry_session.restype = None
 
+class Photogrammetry():
     def set_frame_rate(self, _, frame_rate):
         self.frame_rate = frame_rate
 
+    def set_passthrough(self, _, passthrough):
+        self.passthrough = passthrough
+
+    def set_synchronized(self, _, synchronized):
+        self.synchronized = synchronized
+
     def on_recording_button(self, _):
-        if self.is_writing:
-            return
-        
-        if self.is_recording:
-            self.is_recording = False
+        if self.recorder is None:
+            # the reconstruction setup may still be extracting frames from the last recording
+            if self.reconstruction_status.is_busy():
+                return
+
             os.makedirs("pgm", exist_ok=True)
 
-            if os.path.exists("pgm/recording"):
-                shutil.rmtree("pgm/recording")
+            for directory in ("pgm/recording", "pgm/capture"):
+                if os.path.exists(directory):
+                    shutil.rmtree(directory)
 
             os.makedirs("pgm/recording", exist_ok=True)
 
+            self.capture = None
+            if self.synchronized and len(self.cameras) > 1:
+                # every camera's view of the same moment, so twice the views for the same time over the target
+                self.recorder = self.capture = SyncCapture(self.cameras, "pgm/capture", frame_rate=self.frame_rate)
+            elif self.passthrough and self.camera.supports_passthrough():
+                self.recorder = PassthroughRecorder(self.camera, "pgm/recording/video.mkv")
+            else:
+                self.recorder = Recorder(self.camera, "pgm/recording/video.avi", frame_rate=self.frame_rate)
+            self.recorder.start()
+            dpg.configure_item(self.recording_button, label="Recording...")
+        elif self.recorder.is_recording():
+            self.recorder.stop()
+            self.save_status.set_job(self.jobs.submit("Saving recording", save_recording, self.recorder))
             dpg.configure_item(self.recording_button, label="Saving Recording")
-            self.is_writing = True
-            video_writer = cv2.VideoWriter("pgm/recording/video.avi", cv2.VideoWriter_fourcc(*"MJPG"), 30, (800, 600))
-            for frame in self.recording:
-                video_writer.write(frame)
-            video_writer.release()
-            self.is_writing = False
 
-            dpg.configure_item(self.recording_button, label="Start Recording")
-        else:
-            self.is_recording = True
-            dpg.configure_item(self.recording_button, label="Recording...")
-    
     def update(self):
-        progress = self.lib.get_progress()
-        eta = self.lib.get_eta()
+        if self.recorder is not None and self.recorder.is_finished():
+            self.recorder = None
+            dpg.configure_item(self.recording_button, label="Start Recording")
+
+        if self.capture is not None:
+            dpg.set_value(self.capture_info, self.capture.get_summary())
+
+        job = self.reconstruction_status.job
+
+        # setup failed or was cancelled before a session could start
+        if self.running and job is not None and job.state in ("failed", "cancelled"):
+            self.running = False
+            dpg.configure_item(self.reconstruction_button, label="Start Reconstruction")
+
+        # only once the setup job has started a session, until then the backend still reports the last one
+        session_started = self.running and job is not None and job.state == "done"
+        error = self.backend.get_error() if session_started else None
+        if error is not None:
+            self.running = False
+            dpg.configure_item(self.reconstruction_button, label="Start Reconstruction")
+            dpg.set_value(self.reconstruction_error, error)
+            dpg.show_item(self.reconstruction_error)
+
+        self.save_status.update()
+        self.reconstruction_status.update()
+
+        progress = self.backend.get_progress()
+        eta = self.backend.get_eta()
 
         dpg.set_value(self.progress_bar, progress)
         dpg.configure_item(self.progress_bar, overlay=f"{100 * progress:.2f}%")
         dpg.set_value(self.eta_indicator, f"ETA: {eta:.2f}s")
 
     def toggle_reconstruction(self, _):
-        if self.is_reading:
-            return
-
         if self.running:
             self.running = False
-            self.lib.stop_photogrammetry_session()
+            job = self.reconstruction_status.job
+            # the setup job may be just about to start the session, the lock decides which of the two happens first
+            with self.session_lock:
+                job.cancel()
+                if self.session_job is job:
+                    self.backend.stop_photogrammetry_session()
             dpg.configure_item(self.reconstruction_button, label="Start Reconstruction")
-        else:
+        elif not self.reconstruction_status.is_busy() and not self.save_status.is_busy():
             self.running = True
-
-            os.makedirs("pgm", exist_ok=True)
-            if os.path.exists("pgm/reconstruction"):
-                shutil.rmtree("pgm/reconstruction")
-            os.makedirs("pgm/reconstruction/model", exist_ok=True)
-
-            self.is_reading = True
-
-            dpg.configure_item(self.reconstruction_button, label="Setting up")
-            video_capture = cv2.VideoCapture("pgm/recording/video.avi")
-            # read all frames
-            skip_frames = max(1, 30 // self.frame_rate)
-            frame_count = 0
-            while True:
-                ret, frame = video_capture.read()
-                if not ret:
-                    break
-
-                if frame_count % skip_frames == 0:
-                    cv2.imwrite(f"pgm/reconstruction/frame_{frame_count // skip_frames + 1}.png", frame)
-                
-                frame_count += 1
-            video_capture.release()
-
-            self.is_reading = False
-                
-            # frames = len(os.listdir("pgm/recording"))
-            # skip_frames = max(1, 30 // self.frame_rate)
-            # for frame in range(1, frames + 1, skip_frames):
-            #     shutil.copy(f"pgm/recording/frame_{frame}.png", f"pgm/reconstruction/frame_{frame}.png")
-
-            self.lib.run_photogrammetry_session(b"pgm/reconstruction")
+            dpg.hide_item(self.reconstruction_error)
+            self.reconstruction_status.set_job(self.jobs.submit("Reconstruction", self.start_reconstruction))
             dpg.configure_item(self.reconstruction_button, label="Stop Reconstruction")
 
-    def __init__(self, camera):
-        self.is_recording = False
-        self.is_writing = False
-        self.is_reading = False
-        self.recording = []
+    def start_reconstruction(self, job):
+        os.makedirs("pgm", exist_ok=True)
+        if os.path.exists("pgm/reconstruction"):
+            shutil.rmtree("pgm/reconstruction")
+        os.makedirs("pgm/reconstruction/model", exist_ok=True)
+
+        if self.capture is not None:
+            copy_frames(job, "pgm/capture", "pgm/reconstruction")
+        else:
+            self.extraction_settings.extract(
+                find_recording("pgm/recording"),
+                "pgm/reconstruction",
+                self.frame_rate,
+                progress=job.reporter("Extracting"),
+                executor=job.process_pool
+            )
+
+        # frames = len(os.listdir("pgm/recording"))
+        # skip_frames = max(1, 30 // self.frame_rate)
+        # for frame in range(1, frames + 1, skip_frames):
+        #     shutil.copy(f"pgm/recording/frame_{frame}.png", f"pgm/reconstruction/frame_{frame}.png")
+
+        with self.session_lock:
+            # raises if the reconstruction was stopped while the frames were being prepared
+            job.report(1.0, "Starting session")
+            self.session_job = job
+            self.backend.run_photogrammetry_session("pgm/reconstruction")
+
+    def __init__(self, camera, jobs, window=0, cameras=None):
+        self.camera = camera
+        self.cameras = cameras or [camera]
+        self.jobs = jobs
+        self.recorder = None
+        self.capture = None
+        self.synchronized = False
+        # the only way an H.264 stream's pre-roll makes it into the recording
+        self.passthrough = True
         self.running = False
+        self.session_lock = threading.Lock()
+        self.session_job = None
         self.frame_rate = 30
+        self.backend = create_backend()
 
-        camera.add_callback(self.on_new_frame)
-
-        with dpg.window(label="Photogrammetry"):
+        with dpg.window(label="Photogrammetry", tag=window):
+            dpg.add_text(f"Backend: {self.backend.name}")
             dpg.add_slider_int(label="Frame Rate", default_value=30, min_value=1, max_value=30, callback=self.set_frame_rate)
+            dpg.add_checkbox(label="Passthrough H.264", default_value=self.passthrough, callback=self.set_passthrough)
+            if len(self.cameras) > 1:
+                dpg.add_checkbox(label="Synchronized capture (all cameras)", default_value=self.synchronized, callback=self.set_synchronized)
             self.recording_button = dpg.add_button(label="Start Recording", callback=self.on_recording_button)
+            self.capture_info = dpg.add_text("", show=len(self.cameras) > 1)
+            self.save_status = JobStatus()
             
             dpg.add_separator()
             dpg.add_spacer()
-            
+
+            self.extraction_settings = ExtractionSettings()
+
             with dpg.group(horizontal=True):
                 self.progress_bar = dpg.add_progress_bar(default_value=0.0)
                 self.eta_indicator = dpg.add_text("ETA: 0.0s")
+            self.reconstruction_error = dpg.add_text("", wrap=0, show=False)
 
             with dpg.group(horizontal=True):
                 self.reconstruction_button = dpg.add_button(label="Start Reconstruction", callback=self.toggle_reconstruction)
                 dpg.add_button(label="Open in Preview", callback=lambda: os.system("open pgm/reconstruction/out.usdz"))
                 dpg.add_button(label="Open in Meshlab", callback=lambda: os.system("open -a /Applications/MeshLab2023.12.app pgm/reconstruction/model/out.obj"))
 
-    def on_new_frame(self, frame):
-        if self.is_recording:
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
-            print("recorded frame")
-            self.recording.append(frame)
-
-class CameraStream():
-    def __init__(self, port = 5601):
-        self.pipeline = Gst.parse_launch(
-            # f"udpsrc port={port} ! application/x-rtp,encoding-name=JPEG ! rtpjpegdepay ! jpegdec ! videoconvert ! video/x-raw,format=RGBA ! appsink name=sink"
-            f"udpsrc port={port} ! application/x-rtp,encoding-name=H264 ! rtph264depay ! h264parse ! avdec_h264 ! videoconvert ! video/x-raw,format=RGBA ! appsink name=sink"
-        )
-
-        self.sink = self.pipeline.get_by_name("sink")
-        self.sink.set_property("emit-signals", True)
-        self.sink.connect("new-sample", self.on_new_sample, None)
-        self.pipeline.set_state(Gst.State.PLAYING)
+            dpg.add_separator()
+            self.reconstruction_status = JobStatus()
 
-        self.callbacks = []
+class CameraView():
+    # the window half of a camera, mixed into whichever class runs its pipeline
+    def create_view(self, window=0):
+        self.displayed_sequence = 0
+        self.display_dropped = 0
+        self.upload_time = self.metrics.histogram("texture upload")
+        self.displayed_rate = self.metrics.rate("displayed fps")
+        self.metrics.add_counter("display dropped", lambda: self.display_dropped)
 
         self.stream_dimensions = (640, 480)
-        width, height = self.stream_dimensions
+        self.display_dimensions = self.stream_dimensions
+        self.layout_state = None
+        self.texture_dimensions = self.stream_dimensions
+        width, height = self.texture_dimensions
+
+        # persistent buffers, reused for every frame until the texture size changes
+        self.resized_frame = np.zeros((height, width, 4), dtype=np.uint8)
+        self.texture_data = np.zeros((height, width, 4), dtype=np.float32)
         with dpg.texture_registry():
             self.stream_texture_id = dpg.add_raw_texture(
                 width=width,
                 height=height,
-                default_value=np.zeros((height, width, 4), dtype=np.float32),
+                default_value=self.texture_data,
                 format=dpg.mvFormat_Float_rgba
             )
         
     
-        self.window = dpg.generate_uuid()    
-        with dpg.window(label="Camera Stream", tag=self.window, no_scrollbar=True):
+        self.window = window or dpg.generate_uuid()
+        with dpg.window(label="Camera Stream", tag=self.window, no_scrollbar=True, menubar=True):
+            with dpg.menu_bar():
+                with dpg.menu(label="Profile"):
+                    self.profile_items = {
+                        name: dpg.add_menu_item(label=name, check=True, default_value=name == self.profile, callback=self.on_profile_selected, user_data=name)
+                        for name in PROFILES
+                    }
             self.stream_image = dpg.add_image(self.stream_texture_id)
 
-    def add_callback(self, callback):
-        self.callbacks.append(callback)
+    def on_profile_selected(self, _, __, profile):
+        if profile != self.profile:
+            self.set_profile(profile)
+
+        for name, item in self.profile_items.items():
+            dpg.set_value(item, name == self.profile)
 
     def update_aspect_ratio(self):
         win_width, win_height = dpg.get_item_rect_size(self.window)
         if win_width == 0 or win_height == 0:
             return
 
+        # only lay the image out again when the window or the stream actually changed size
+        layout_state = (win_width, win_height, self.stream_dimensions)
+        if layout_state == self.layout_state:
+            return
+        self.layout_state = layout_state
+
         image_aspect = self.stream_dimensions[0] / self.stream_dimensions[1]
         window_aspect = win_width / win_height
 
@@ -311,65 +611,180 @@ class CameraStream():
         dpg.set_item_width(self.stream_image, image_width)
         dpg.set_item_height(self.stream_image, image_height)
         dpg.set_item_pos(self.stream_image, [pos_x, pos_y])
-    
-    def update(self, frame):
-        frame = frame.astype(np.float32) / 255.0
+        self.display_dimensions = (image_width, image_height)
+
+    def get_texture_dimensions(self):
+        stream_width, stream_height = self.stream_dimensions
+        display_width, display_height = self.display_dimensions
+        if display_width >= stream_width or display_height >= stream_height:
+            return self.stream_dimensions
+
+        # round up to a multiple of 16 so that resizing the window doesn't recreate the texture every frame
+        width = min(stream_width, -(-display_width // 16) * 16)
+        height = max(1, round(width * stream_height / stream_width))
+        return (width, height)
+
+    def create_texture(self, dimensions):
+        width, height = dimensions
+        self.texture_dimensions = dimensions
+        self.resized_frame = np.zeros((height, width, 4), dtype=np.uint8)
+        self.texture_data = np.zeros((height, width, 4), dtype=np.float32)
+
+        old_texture_id = self.stream_texture_id
+        with dpg.texture_registry():
+            self.stream_texture_id = dpg.add_raw_texture(
+                width=width,
+                height=height,
+                default_value=self.texture_data,
+                format=dpg.mvFormat_Float_rgba
+            )
+        dpg.configure_item(self.stream_image, texture_tag=self.stream_texture_id)
+        dpg.delete_item(old_texture_id)
+
+    def update(self):
+        sequence, frame = self.latest_frame
+        if frame is None or sequence == self.displayed_sequence:
+            return
+
+        self.display_dropped += sequence - self.displayed_sequence - 1
+        self.displayed_sequence = sequence
 
+        start = time.perf_counter()
+        if not self.update_texture(frame, sequence):
+            # the worker wrote over the slot while it was being read, a newer frame is already on its way
+            self.display_dropped += 1
+            return
+        self.upload_time.record(time.perf_counter() - start)
+        self.displayed_rate.tick()
+
+    def update_texture(self, frame, sequence):
         height, width, _ = frame.shape
-        frame_dimensions = (width, height)
-
-        if frame_dimensions != self.stream_dimensions:
-            dpg.delete_item(self.stream_texture_id)
-            self.stream_dimensions = frame_dimensions
-            with dpg.texture_registry():
-                self.stream_texture_id = dpg.add_raw_texture(
-                    width=width,
-                    height=height,
-                    default_value=frame,
-                    format=dpg.mvFormat_Float_rgba
-                )
-                dpg.configure_item(self.stream_image, texture_tag=self.stream_texture_id)
-        else:
-            dpg.set_value(self.stream_texture_id, frame)
-        
+        self.stream_dimensions = (width, height)
 
-    def on_new_sample(self, sink, _):
-        sample = sink.emit("pull-sample")
+        texture_dimensions = self.get_texture_dimensions()
+        if texture_dimensions != self.texture_dimensions:
+            self.create_texture(texture_dimensions)
 
-        caps = sample.get_caps()
-        buffer = sample.get_buffer()
+        if texture_dimensions != self.stream_dimensions:
+            frame = cv2.resize(frame, texture_dimensions, dst=self.resized_frame, interpolation=cv2.INTER_AREA)
+        elif self.shared_frames:
+            # the raw texture is drawn from texture_data as is, so a frame the worker may still overwrite is staged first
+            np.copyto(self.resized_frame, frame)
+            frame = self.resized_frame
 
-        width = caps.get_structure(0).get_value("width")
-        height = caps.get_structure(0).get_value("height")
-        
-        success, map_info = buffer.map(Gst.MapFlags.READ)
-        if not success:
-            print("Failed to map buffer")
-            return Gst.FlowReturn.ERROR
-        
-        frame = np.ndarray(
-            (height, width, 4),
-            buffer=map_info.data,
-            dtype=np.uint8
-        )
-        self.update(frame)
+        if not self.is_frame_current(sequence):
+            return False
 
-        for callback in self.callbacks:
-            callback(frame)
+        # raw textures only take floats, so convert in place instead of allocating a new array per frame
+        np.multiply(frame, np.float32(1 / 255), out=self.texture_data, dtype=np.float32)
+        dpg.set_value(self.stream_texture_id, self.texture_data)
+        return True
 
-        buffer.unmap(map_info)
+# the pipeline starts in the constructor, the window comes from create_view on the main thread
+class CameraStream(CameraView, StreamPipeline):
+    pass
+
+class ProcessCameraStream(CameraView, CameraProcess):
+    pass
 
-        return Gst.FlowReturn.OK
+class LazyPanel():
+    # builds its panel once video is on screen, a panel that fails to load is shown disabled instead
+    def __init__(self, name, factory, window=0):
+        self.name = name
+        self.factory = factory
+        # reserved now so the saved layout still finds the window when it's built later
+        self.window = window or dpg.generate_uuid()
+        self.panel = None
+        self.error = None
+
+    def load(self):
+        with trace.span(f"build {self.name}"):
+            try:
+                self.panel = self.factory(self.window)
+            except (ImportError, OSError, ValueError) as e:
+                # a missing native library or module, or a bad setting, only costs this panel
+                print(f"{self.name} disabled: {e}")
+                self.error = e
+                if not dpg.does_item_exist(self.window):
+                    with dpg.window(label=self.name, tag=self.window):
+                        dpg.add_text(f"{self.name} is unavailable:\n{e}")
+
+    def update(self):
+        if self.panel is not None:
+            self.panel.update()
+
+class MetricsWindow():
+    columns = ("Source", "Stage", "p50 (ms)", "p99 (ms)", "Count", "FPS")
+
+    def __init__(self, sources, refresh_interval=0.5, log_interval=5.0):
+        self.sources = sources
+        self.refresh_interval = refresh_interval
+        self.log_interval = log_interval
+        self.next_refresh = 0
+        self.next_log = 0
+        self.log_path = None
+        self.cells = {}
+
+        with dpg.window(label="Metrics"):
+            with dpg.group(horizontal=True):
+                dpg.add_button(label="Export CSV", callback=self.on_export_button)
+                dpg.add_checkbox(label="Log to CSV", callback=self.set_logging)
+
+            with dpg.table(header_row=True, resizable=True, policy=dpg.mvTable_SizingStretchProp) as self.table:
+                for column in self.columns:
+                    dpg.add_table_column(label=column)
+
+    def get_rows(self):
+        return [row for source in self.sources for row in source.get_rows()]
+
+    def on_export_button(self, _):
+        write_csv(time.strftime("metrics/metrics_%Y%m%d_%H%M%S.csv"), self.get_rows())
+
+    def set_logging(self, _, logging):
+        self.log_path = time.strftime("metrics/log_%Y%m%d_%H%M%S.csv") if logging else None
+
+    def update(self):
+        now = time.perf_counter()
+        if now < self.next_refresh:
+            return
+        self.next_refresh = now + self.refresh_interval
+
+        rows = self.get_rows()
+        for row in rows:
+            key = (row["source"], row["stage"])
+            if key not in self.cells:
+                with dpg.table_row(parent=self.table):
+                    self.cells[key] = [dpg.add_text("") for _ in self.columns]
+
+            values = (
+                row["source"],
+                row["stage"],
+                f"{row['p50_ms']:.2f}" if "p50_ms" in row else "",
+                f"{row['p99_ms']:.2f}" if "p99_ms" in row else "",
+                str(row["count"]) if "count" in row else "",
+                f"{row['fps']:.1f}" if "fps" in row else "",
+            )
+            for cell, value in zip(self.cells[key], values):
+                dpg.set_value(cell, value)
+
+        if self.log_path is not None and now >= self.next_log:
+            self.next_log = now + self.log_interval
+            write_csv(self.log_path, rows, append=True)
 
 class Carp():
-    def __init__(self):
+    def __init__(self, jobs, window=0):
+        # cairo is only needed here, a machine without it just goes without this panel
+        import carp
+        self.carp = carp
+
+        self.jobs = jobs
         self.file_dialog = dpg.generate_uuid()
         self.file = None
 
         with dpg.file_dialog(directory_selector=False, default_path="~/dev/mate-2025", show=False, callback=self.on_file_select, width=700 ,height=400, id=self.file_dialog):
             dpg.add_file_extension(".csv")
 
-        with dpg.window(label="Carp"):
+        with dpg.window(label="Carp", tag=window):
             with dpg.group(horizontal=True):
                 self.file_label = dpg.add_text("Nothing selected")
                 dpg.add_button(label="Select File", callback=lambda: dpg.show_item(self.file_dialog))
@@ -377,94 +792,176 @@ class Carp():
             dpg.add_separator()
 
             dpg.add_button(label = "Run", callback=self.on_run_button)
+            self.status = JobStatus()
 
     def on_file_select(self, _, file):
         # dpg.configure_item(self.file_label, label=file['file_name'])
         dpg.set_value(self.file_label, file['file_name'])
         self.file = file['file_path_name']
     
-    def on_run_button(self, _):
-        vw = cv2.VideoWriter("carp.mp4", cv2.VideoWriter_fourcc(*"mp4v"), 1, (932, 1241))
-        for year, *state in pd.read_csv(self.file).values:
-            surface = cairo.ImageSurface.create_from_png("illinois.png")
-            ctx = cairo.Context(surface)
-
-            regions = [
-                "m 216.82162,637.75901 c -1.10607,1.5775 -2.21213,3.15497 -3.41356,4.3095 -1.20143,1.15452 -2.49821,1.88606 -5.68297,11.34232 -3.18476,9.45626 -8.25743,27.63699 -8.37583,35.7971 -0.11839,8.16011 4.7175,6.29918 6.02743,14.44337 1.30992,8.1442 -0.90617,26.29352 -2.6646,38.20699 -1.75844,11.91346 -3.05919,17.59091 -1.83432,21.8778 1.22486,4.28688 4.97531,7.18307 5.15645,9.41243 0.18115,2.22936 -3.20704,3.79187 -4.3036,6.32251 -1.09656,2.53065 0.0985,6.02943 1.77986,14.79163 1.68136,8.76221 3.84902,22.78783 6.85253,26.48943 3.00352,3.7016 6.84287,-2.92078 9.37259,-5.51379 2.52971,-2.59302 3.74973,-1.15657 4.96973,0.27986",
-                "m 216.43486,637.06441 c 2.49603,-5.08807 4.99206,-10.17613 7.51212,-13.20018 2.52006,-3.02405 5.06404,-3.98404 7.94411,-7.15214 2.88007,-3.1681 6.09605,-8.54406 11.28019,-12.24013 5.18414,-3.69607 12.33609,-5.71205 17.04018,-8.59213 4.70409,-2.88008 6.96007,-6.62405 8.73611,-8.78408 1.77603,-2.16004 3.07202,-2.73603 5.59209,-5.16011 2.52008,-2.42407 6.26405,-6.69605 9.38412,-12.02418 3.12006,-5.32813 5.61604,-11.71209 9.36014,-16.27218 3.7441,-4.56009 8.73607,-7.29607 12.21614,-10.80016 3.48006,-3.50409 5.44805,-7.77606 10.5602,-11.71215 5.11215,-3.93608 13.36809,-7.53606 21.6242,-11.13611",
-                "m 337.33623,519.81964 c 2.32785,-0.60727 4.6557,-1.21453 8.09692,-5.51608 3.44122,-4.30154 7.99562,-12.29705 10.72833,-17.40823 2.73271,-5.11118 3.64359,-7.33777 3.99783,-9.66565 0.35423,-2.32788 0.15181,-4.75689 1.21455,-8.856 1.06274,-4.0991 3.39055,-9.86801 5.5666,-13.96708 2.17606,-4.09907 4.20024,-6.52808 5.31356,-8.55232 1.11332,-2.02424 1.31574,-3.64358 2.27726,-5.06055 0.96152,-1.41696 2.68208,-2.63147 3.69419,-6.32574 1.01211,-3.69426 1.31574,-9.868 4.1497,-15.94072 2.83396,-6.07272 8.19804,-12.04405 11.08255,-15.38402 2.88452,-3.33997 3.28936,-4.04843 2.22662,-7.64149 -1.06274,-3.59305 -3.59296,-10.07042 -4.45325,-14.37191 -0.86029,-4.30149 -0.0506,-6.42688 1.31575,-7.99566 1.36637,-1.56878 3.28934,-2.58087 10.01999,-3.54238 6.73064,-0.96152 18.26846,-1.8724 29.80652,-2.7833",
-                "m 432.67698,376.50488 c 5.06055,0.30363 10.1211,0.60727 15.68777,-0.0506 5.56666,-0.65789 11.6392,-2.27723 16.14312,-2.68207 4.50391,-0.40483 7.43897,0.40484 9.71623,1.16393 2.27727,0.75909 3.89661,1.46755 8.34997,2.27725 4.45336,0.8097 11.7404,1.72057 22.36769,-0.3037 10.6273,-2.02427 24.59414,-6.98351 32.438,-9.81742 7.84387,-2.83391 9.56443,-3.54238 11.94292,-4.95935 2.37848,-1.41698 5.41475,-3.54236 8.29929,-6.52813 2.88454,-2.98576 5.61718,-6.8317 7.64142,-10.62715 2.02423,-3.79545 3.33995,-7.54018 4.20024,-11.43685 0.8603,-3.89666 1.26514,-7.94502 1.61938,-10.93076 0.35424,-2.98574 0.65787,-4.90871 3.59304,-8.24872 2.93518,-3.34002 8.50167,-8.09684 14.37197,-13.00562 5.8703,-4.90878 12.04405,-9.96923 17.00342,-13.86588 4.95938,-3.89665 8.70411,-6.62929 13.5623,-9.46323 4.85818,-2.83394 10.82951,-5.769 16.80096,-8.70412",
-                "m 612.4277,155.15645 c 0.30363,2.42906 0.60727,4.85812 0.65787,7.33781 0.0506,2.4797 -0.15182,5.00993 -0.8097,8.0969 -0.65788,3.08697 -1.77118,6.73049 -2.68208,9.96927 -0.91091,3.23878 -1.61937,6.07263 -1.77119,9.21021 -0.15181,3.13757 0.25303,6.57868 1.31576,10.77898 1.06273,4.20031 2.78328,9.15955 5.21238,13.96712 2.42909,4.80757 5.56657,9.46318 8.4005,13.1068 2.83394,3.64362 5.36416,6.27506 6.98354,9.9693 1.61938,3.69425 2.32785,8.45107 3.28937,11.68984 0.96151,3.23877 2.17602,4.95933 2.73268,7.2366 0.55666,2.27728 0.45545,5.11113 1.01212,7.23657 0.55667,2.12545 1.77118,3.54237 2.42905,5.81965 0.65788,2.27728 0.75909,5.41476 2.07485,9.8681 1.31577,4.45334 3.846,10.22225 5.76902,13.15737 1.92302,2.93512 3.23874,3.03633 5.06056,5.31362 1.82182,2.27729 4.14963,6.73049 6.4775,9.21016 2.32788,2.47968 4.65568,2.98572 6.5281,4.30149 1.87242,1.31576 3.28934,3.44115 5.00995,4.95932 1.72061,1.51818 3.74479,2.42906 7.0848,3.08694 3.34001,0.65787 7.99562,1.06271 13.71411,0.55664 5.71848,-0.50607 12.49949,-1.923 18.92645,-3.74482 6.42695,-1.82182 12.49949,-4.04842 19.17949,-7.38843 6.68,-3.34 13.96704,-7.7932 19.98914,-12.90441 6.0221,-5.11121 10.77892,-10.88012 14.72619,-16.5986 3.94726,-5.71848 7.08473,-11.38618 9.31139,-16.6492 2.22665,-5.26302 3.54237,-10.12105 4.85811,-14.97918"
-            ]
-            
-            ctx.select_font_face("Comic Sans MS", cairo.FONT_SLANT_NORMAL,
-                                cairo.FONT_WEIGHT_BOLD)
-            ctx.set_font_size(120.958)
-            ctx.move_to(11.884668, 1210.7764)
-            ctx.show_text(str(year))
+    def update(self):
+        self.status.update()
 
-            ctx.set_line_width(10)
-            ctx.set_source_rgba(0, 0, 1, 1)
+    def on_run_button(self, _):
+        if self.file is None or self.status.is_busy():
+            return
 
-            for region, is_shown in zip(regions, state):
-                if is_shown == "Y":
-                    move_points = "(?:(m) (-?[\\d.]+),(-?[\\d.]+) ?)"
-                    curve_points = "(?:(-?[\\d.]+),(-?[\\d.]+) (-?[\\d.]+),(-?[\\d.]+) (-?[\\d.]+),(-?[\\d.]+) ?)"
+        self.status.set_job(self.jobs.submit("Rendering", self.render, self.file))
 
-                    ctx.move_to(*[float(x) for x in re.search(move_points, region).groups()[1:]])
-                    for x in re.findall(curve_points, region):
-                        ctx.rel_curve_to(*[float(y) for y in x])
+    def render(self, job, file):
+        # pandas takes a noticeable part of a second to import and nothing else needs it
+        import pandas as pd
 
-                    ctx.stroke()
+        rows = pd.read_csv(file).values
+        years = [row[0] for row in rows]
+        states = [list(row[1:]) for row in rows]
+        map_paths = ["illinois.png"] * len(rows)
 
-            buf = np.ndarray(shape=(1241, 932, 4), dtype=np.uint8, buffer=surface.get_data())
-            vw.write(cv2.cvtColor(buf, cv2.COLOR_RGBA2BGR))
+        video_writer = None
+        try:
+            # contiguous chunks keep consecutive years on the same worker so unchanged regions hit its cache
+            frames = job.process_pool.map(self.carp.render_frame, years, states, map_paths, chunksize=8)
+            for i, frame in enumerate(frames):
+                if video_writer is None:
+                    height, width, _ = frame.shape
+                    video_writer = cv2.VideoWriter("carp.mp4", cv2.VideoWriter_fourcc(*"mp4v"), 1, (width, height))
 
-        vw.release()
+                video_writer.write(frame)
+                job.report((i + 1) / len(rows), "Rendering")
+        finally:
+            if video_writer is not None:
+                video_writer.release()
 
         os.system("open carp.mp4")
 
 class Notes():
-    def __init__(self):
-        self.window = dpg.generate_uuid()
+    def __init__(self, window=0):
+        self.window = window or dpg.generate_uuid()
         with dpg.window(label="Notes", tag = self.window):
             self.input = dpg.add_input_text(default_value=
                 "Ship Height (Back Right): 30.5 (colored)\n\n\n\n\n\n\n\n\n\nLength: 189",
                 multiline=True
             )
+        self.size = None
     
     def update(self):
         width = dpg.get_item_width(self.window)
         height = dpg.get_item_height(self.window)
+        if (width, height) == self.size:
+            return
+        self.size = (width, height)
 
         dpg.set_item_width(self.input, width - 16)
         dpg.set_item_height(self.input, height - 40)
 
 
 
-camera_stream1 = CameraStream(5600)
-camera_stream2 = CameraStream(5601)
-photogrammetry = Photogrammetry(camera = camera_stream2)
-photosphere = Photosphere(camera = camera_stream2)
-carp = Carp()
-notes = Notes()
-
-dpg.setup_dearpygui()
-dpg.show_viewport()
-try:
-    while dpg.is_dearpygui_running():
-        camera_stream1.update_aspect_ratio()
-        camera_stream2.update_aspect_ratio()
-        photogrammetry.update()
-        notes.update()
-
-        dpg.render_dearpygui_frame()
-except KeyboardInterrupt:
-    pass
-
-should_save_config = input("Should I save the config? (y/n)")
-if should_save_config.lower() == "y":
-    dpg.save_init_file("mate.ini")
-    print("Saved config")
-
-dpg.destroy_context()
\ No newline at end of file
+def main():
+    layout_windows = setup_dearpygui()
+
+    # decoding in a worker process per camera keeps the GIL free for the UI, opt in while it's new
+    camera_class = ProcessCameraStream if os.environ.get("MATE_CAMERA_PROCESSES") == "1" else CameraStream
+
+    def start_camera(port):
+        with trace.span(f"start camera {port}"):
+            return camera_class(port)
+
+    # the pipelines don't depend on each other, only the windows have to be made on this thread
+    with concurrent.futures.ThreadPoolExecutor(2, thread_name_prefix="camera-start") as executor:
+        camera_stream1, camera_stream2 = executor.map(start_camera, (5600, 5601))
+    for camera in (camera_stream1, camera_stream2):
+        with trace.span(f"view camera {camera.port}"):
+            camera.create_view(layout_windows[f"camera {camera.port}"])
+
+    # a whole mission of pre-roll fits a laptop, it's compressed and capped in both time and memory
+    preroll_seconds = float(os.environ.get("MATE_PREROLL_SECONDS", 30))
+    preroll_megabytes = float(os.environ.get("MATE_PREROLL_MB", 256))
+    if preroll_seconds > 0:
+        camera_stream1.enable_preroll(preroll_seconds, int(preroll_megabytes * 2 ** 20))
+        camera_stream2.enable_preroll(preroll_seconds, int(preroll_megabytes * 2 ** 20))
+
+    jobs = JobExecutor()
+    loop_metrics = Metrics("Main loop")
+    metrics_window = MetricsWindow([camera_stream1.metrics, camera_stream2.metrics, loop_metrics])
+
+    # nothing here is needed for the first frames, they're built one per frame once video is up
+    cameras = [camera_stream1, camera_stream2]
+    photogrammetry = LazyPanel("Photogrammetry", lambda window: Photogrammetry(camera = camera_stream2, jobs = jobs, window = window, cameras = cameras), layout_windows["Photogrammetry"])
+    photosphere = LazyPanel("Photosphere", lambda window: Photosphere(camera = camera_stream2, jobs = jobs, window = window, cameras = cameras), layout_windows["Photosphere"])
+    carp_panel = LazyPanel("Carp", lambda window: Carp(jobs = jobs, window = window), layout_windows["Carp"])
+    notes = LazyPanel("Notes", lambda window: Notes(window = window), layout_windows["Notes"])
+    pending_panels = [photogrammetry, photosphere, carp_panel, notes]
+
+    # renders only when there's something new to show, panels update at their own rates within a frame budget
+    scheduler = Scheduler(loop_metrics)
+    for camera in (camera_stream1, camera_stream2):
+        camera.frame_listeners.append(scheduler.wake)
+        scheduler.add(f"camera {camera.port}.update_aspect_ratio", camera.update_aspect_ratio, essential=True)
+        scheduler.add(f"camera {camera.port}.update", camera.update, essential=True)
+    scheduler.add("photogrammetry.update", photogrammetry.update, rate=2)
+    scheduler.add("photosphere.update", photosphere.update, rate=10)
+    scheduler.add("carp.update", carp_panel.update, rate=5)
+    scheduler.add("notes.update", notes.update, rate=10)
+    scheduler.add("metrics.update", metrics_window.update, rate=1 / metrics_window.refresh_interval)
+
+    with dpg.handler_registry():
+        dpg.add_mouse_move_handler(callback=scheduler.on_input)
+        dpg.add_mouse_click_handler(callback=scheduler.on_input)
+        dpg.add_mouse_wheel_handler(callback=scheduler.on_input)
+        dpg.add_key_press_handler(callback=scheduler.on_input)
+    dpg.set_viewport_resize_callback(scheduler.on_input)
+
+    waiting_cameras = [camera_stream1, camera_stream2]
+
+    def load_panels():
+        for camera in list(waiting_cameras):
+            if camera.displayed_sequence > 0:
+                trace.mark(f"first frame camera {camera.port}")
+                waiting_cameras.remove(camera)
+
+        # a camera that never comes up shouldn't hold the rest of the UI back for long
+        if pending_panels and (not waiting_cameras or time.perf_counter() - trace.start > 5):
+            pending_panels.pop(0).load()
+        elif not pending_panels:
+            trace.mark("all panels built")
+            trace.report()
+            scheduler.remove(load_panels_task)
+
+    load_panels_task = scheduler.add("load panels", load_panels)
+
+    with trace.span("show viewport"):
+        dpg.setup_dearpygui()
+        dpg.show_viewport()
+    try:
+        frame_time = loop_metrics.histogram("frame")
+        render_time = loop_metrics.histogram("render_dearpygui_frame")
+        frame_rate = loop_metrics.rate("fps")
+
+        while dpg.is_dearpygui_running():
+            start = scheduler.wait()
+            frame_rate.tick(start)
+
+            scheduler.run(start)
+
+            render_start = time.perf_counter()
+            dpg.render_dearpygui_frame()
+            render_done = time.perf_counter()
+            render_time.record(render_done - render_start)
+            frame_time.record(render_done - start)
+    except KeyboardInterrupt:
+        pass
+
+    jobs.shutdown()
+    camera_stream1.close()
+    camera_stream2.close()
+
+    should_save_config = input("Should I save the config? (y/n)")
+    if should_save_config.lower() == "y":
+        dpg.save_init_file("mate.ini")
+        print("Saved config")
+
+    dpg.destroy_context()
+
+# worker processes re-import this module, only the launching process may build the UI
+if __name__ == "__main__":
+    main()
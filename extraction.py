@@ -0,0 +1,124 @@
+import concurrent.futures
+import multiprocessing
+import os
+import re
+import cv2
+
+IMAGE_FORMATS = {
+    "PNG": ("png", cv2.IMWRITE_PNG_COMPRESSION, 0, 9, 3),
+    "JPEG": ("jpg", cv2.IMWRITE_JPEG_QUALITY, 1, 100, 95),
+}
+
+def get_frame_stride(path, frame_rate):
+    video_capture = cv2.VideoCapture(path)
+    fps = video_capture.get(cv2.CAP_PROP_FPS) or 30
+    video_capture.release()
+
+    # decimated recordings only skip if the rate was lowered since, passthrough ones run at the stream rate
+    return max(1, round(fps / frame_rate))
+
+def get_frame_count(path):
+    video_capture = cv2.VideoCapture(path)
+    frame_count = int(video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    video_capture.release()
+
+    return frame_count
+
+def list_frames(output_dir):
+    # sort by frame number rather than name so frame_10 comes after frame_9
+    pattern = re.compile(r"(\d+)\.(png|jpg|jpeg)$", re.IGNORECASE)
+    frames = [(int(match.group(1)), name) for name in os.listdir(output_dir) if (match := pattern.search(name))]
+    return [os.path.join(output_dir, name) for _, name in sorted(frames)]
+
+def open_at(path, frame_index):
+    video_capture = cv2.VideoCapture(path)
+    if frame_index == 0:
+        return video_capture, 0
+
+    video_capture.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+    if int(video_capture.get(cv2.CAP_PROP_POS_FRAMES)) == frame_index:
+        return video_capture, frame_index
+
+    # the container can't seek exactly, grab forward from the start instead
+    video_capture.release()
+    return cv2.VideoCapture(path), 0
+
+def extract_segment(path, output_dir, frames, extension, params, stride_to_end=None):
+    video_capture, position = open_at(path, frames[0][0])
+
+    def frames_to_write():
+        yield from frames
+        if stride_to_end:
+            # frame counts are estimates for some containers, keep going until the video actually ends
+            frame_index, number = frames[-1]
+            while True:
+                frame_index += stride_to_end
+                number += 1
+                yield frame_index, number
+
+    written = 0
+    pending = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as encoder:
+        for frame_index, number in frames_to_write():
+            # grab() skips decoding the frames we throw away
+            while position < frame_index and video_capture.grab():
+                position += 1
+
+            ret, frame = video_capture.read()
+            if not ret:
+                break
+            position += 1
+
+            pending.append(encoder.submit(cv2.imwrite, os.path.join(output_dir, f"frame_{number}.{extension}"), frame, params))
+            if len(pending) >= 8:
+                written += sum(future.result() for future in pending)
+                pending = []
+
+        written += sum(future.result() for future in pending)
+
+    video_capture.release()
+    return written
+
+def extract_frames(path, output_dir, frame_rate=30, indices=None, image_format="PNG", level=None,
+                   progress=None, executor=None, frames_per_segment=32):
+    extension, flag, _, _, default_level = IMAGE_FORMATS[image_format]
+    params = [flag, int(default_level if level is None else level)]
+
+    stride_to_end = None
+    if indices is None:
+        stride = get_frame_stride(path, frame_rate)
+        indices = range(0, max(1, get_frame_count(path)), stride)
+        stride_to_end = stride
+
+    frames = [(frame_index, number + 1) for number, frame_index in enumerate(indices)]
+    if not frames:
+        return 0
+
+    segments = [frames[i:i + frames_per_segment] for i in range(0, len(frames), frames_per_segment)]
+
+    owns_executor = executor is None
+    if owns_executor:
+        executor = concurrent.futures.ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn"))
+
+    futures = [
+        executor.submit(extract_segment, path, output_dir, segment, extension, params,
+                        stride_to_end if i == len(segments) - 1 else None)
+        for i, segment in enumerate(segments)
+    ]
+
+    try:
+        written = 0
+        for future in concurrent.futures.as_completed(futures):
+            written += future.result()
+            if progress is not None:
+                progress(min(1.0, written / len(frames)))
+    except BaseException:
+        # a shared pool outlives us, so don't leave the remaining segments queued on it
+        for future in futures:
+            future.cancel()
+        raise
+    finally:
+        if owns_executor:
+            executor.shutdown(cancel_futures=True)
+
+    return written
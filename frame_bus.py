@@ -0,0 +1,137 @@
+import collections
+import threading
+import time
+
+from metrics import Histogram
+
+class Subscriber():
+    def __init__(self, callback, policy="latest", max_frames=1, frame_rate=None, name=None, timestamps=False):
+        # "latest" keeps only the newest frame, "queue" keeps up to max_frames in order and drops new ones when full
+        if policy not in ("latest", "queue"):
+            raise ValueError(f"Unknown drop policy: {policy}")
+
+        self.callback = callback
+        self.policy = policy
+        self.max_frames = 1 if policy == "latest" else max(1, max_frames)
+        self.name = name or getattr(callback, "__qualname__", repr(callback))
+        self.on_close = None
+        # the callback also gets each frame's capture time in clock nanoseconds, None where it's unknown
+        self.timestamps = timestamps
+
+        # decimate before queueing so skipped frames never take up a slot
+        self.frame_interval = 1 / frame_rate if frame_rate else 0
+        self.next_frame_time = 0
+
+        self.delivered = 0
+        self.dropped = 0
+        self.callback_time = Histogram()
+
+        self.frames = collections.deque()
+        self.condition = threading.Condition()
+        self.closed = False
+
+        self.thread = threading.Thread(target=self.run, name=f"subscriber {self.name}", daemon=True)
+        self.thread.start()
+
+    def publish(self, frame, timestamp=None):
+        with self.condition:
+            if self.closed:
+                return
+
+            if self.frame_interval:
+                now = time.monotonic()
+                # a quarter interval of slack so arrival jitter doesn't halve the rate
+                if now < self.next_frame_time - self.frame_interval / 4:
+                    return
+                self.next_frame_time = max(self.next_frame_time, now - self.frame_interval / 4) + self.frame_interval
+
+            if len(self.frames) >= self.max_frames:
+                self.dropped += 1
+                # the publisher is a pipeline thread, it never waits for a subscriber that fell behind
+                if self.policy == "queue":
+                    return
+                self.frames.popleft()
+
+            self.frames.append((frame, timestamp))
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.frames or self.closed)
+                if not self.frames:
+                    break
+
+                frame, timestamp = self.frames.popleft()
+                self.condition.notify_all()
+
+            start = time.perf_counter()
+            try:
+                if self.timestamps:
+                    self.callback(frame, timestamp)
+                else:
+                    self.callback(frame)
+            except Exception as e:
+                print(f"Subscriber {self.name} failed: {e}")
+
+            self.callback_time.record(time.perf_counter() - start)
+            self.delivered += 1
+
+        if self.on_close is not None:
+            self.on_close()
+
+    def close(self, drain=True):
+        with self.condition:
+            self.closed = True
+            if not drain:
+                self.dropped += len(self.frames)
+                self.frames.clear()
+            self.condition.notify_all()
+
+    def join(self, timeout=None):
+        self.thread.join(timeout)
+
+    def get_stats(self):
+        return {
+            "name": self.name,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "queued": len(self.frames),
+            "p50_ms": 1000 * self.callback_time.percentile(50),
+            "p99_ms": 1000 * self.callback_time.percentile(99),
+        }
+
+class FrameBus():
+    def __init__(self):
+        self.subscribers = []
+        self.lock = threading.Lock()
+
+    def subscribe(self, callback, policy="latest", max_frames=1, frame_rate=None, name=None, timestamps=False):
+        subscriber = Subscriber(callback, policy=policy, max_frames=max_frames, frame_rate=frame_rate, name=name, timestamps=timestamps)
+
+        # copy on write so that publish never has to take the lock
+        with self.lock:
+            self.subscribers = self.subscribers + [subscriber]
+
+        return subscriber
+
+    def unsubscribe(self, subscriber, drain=True):
+        with self.lock:
+            self.subscribers = [s for s in self.subscribers if s is not subscriber]
+
+        subscriber.close(drain=drain)
+
+    def publish(self, frame, timestamp=None):
+        for subscriber in self.subscribers:
+            subscriber.publish(frame, timestamp)
+
+    def get_stats(self):
+        return [subscriber.get_stats() for subscriber in self.subscribers]
+
+    def close(self):
+        with self.lock:
+            subscribers = self.subscribers
+            self.subscribers = []
+
+        for subscriber in subscribers:
+            subscriber.close(drain=False)
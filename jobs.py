@@ -0,0 +1,112 @@
+import collections
+import concurrent.futures
+import multiprocessing
+import threading
+
+Progress = collections.namedtuple("Progress", ("fraction", "message"))
+
+class JobCancelled(Exception):
+    pass
+
+class Job():
+    def __init__(self, name, executor):
+        self.name = name
+        self.executor = executor
+
+        # replaced as a whole so the main loop can read it without a lock
+        self.progress = Progress(0.0, "Queued")
+        self.state = "queued"
+        self.result = None
+        self.error = None
+
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    @property
+    def process_pool(self):
+        return self.executor.get_process_pool()
+
+    def report(self, fraction=None, message=None):
+        # cancellation is cooperative, every progress report is a cancellation point
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+        self.progress = Progress(
+            self.progress.fraction if fraction is None else fraction,
+            self.progress.message if message is None else message
+        )
+
+    def reporter(self, message, start=0.0, end=1.0):
+        self.report(start, message)
+        return lambda fraction: self.report(start + (end - start) * fraction)
+
+    def run_in_process(self, function, *args):
+        future = self.process_pool.submit(function, *args)
+        while True:
+            try:
+                return future.result(timeout=0.1)
+            except concurrent.futures.TimeoutError:
+                if self.cancel_event.is_set():
+                    future.cancel()
+                    raise JobCancelled()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
+
+    def is_running(self):
+        return self.state in ("queued", "running")
+
+    def is_done(self):
+        return not self.is_running()
+
+class JobExecutor():
+    def __init__(self, max_threads=4, max_processes=None):
+        self.thread_pool = concurrent.futures.ThreadPoolExecutor(max_threads, thread_name_prefix="job")
+        self.max_processes = max_processes
+        self.process_pool = None
+        self.lock = threading.Lock()
+        self.jobs = []
+
+    def get_process_pool(self):
+        # only spawn worker processes once something CPU bound actually runs
+        with self.lock:
+            if self.process_pool is None:
+                # forking a process that already runs GStreamer, DearPyGui and subscriber threads can deadlock the child
+                self.process_pool = concurrent.futures.ProcessPoolExecutor(self.max_processes, mp_context=multiprocessing.get_context("spawn"))
+            return self.process_pool
+
+    def submit(self, name, function, *args, **kwargs):
+        job = Job(name, self)
+        with self.lock:
+            self.jobs = [j for j in self.jobs if j.is_running()] + [job]
+
+        job.future = self.thread_pool.submit(self.run, job, function, args, kwargs)
+        return job
+
+    def run(self, job, function, args, kwargs):
+        job.state = "running"
+        job.progress = Progress(0.0, job.name)
+
+        try:
+            job.result = function(job, *args, **kwargs)
+            job.state = "done"
+            job.progress = Progress(1.0, "Done")
+        except JobCancelled:
+            job.state = "cancelled"
+            job.progress = Progress(job.progress.fraction, "Cancelled")
+        except Exception as e:
+            print(f"Job {job.name} failed: {e}")
+            job.error = e
+            job.state = "failed"
+            job.progress = Progress(job.progress.fraction, f"Failed: {e}")
+
+    def shutdown(self):
+        for job in self.jobs:
+            job.cancel()
+
+        self.thread_pool.shutdown(wait=False, cancel_futures=True)
+        if self.process_pool is not None:
+            self.process_pool.shutdown(wait=False, cancel_futures=True)
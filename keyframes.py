@@ -0,0 +1,167 @@
+import concurrent.futures
+import multiprocessing
+import numpy as np
+import cv2
+
+from extraction import extract_frames, get_frame_count
+
+SCORE_FIELDS = ("index", "sharpness", "brightness", "clipped", "dx", "dy", "response")
+
+def score_segment(path, start, stop, width=320):
+    video_capture = cv2.VideoCapture(path)
+
+    # start one frame early so the first frame of the segment still gets a motion estimate
+    first = max(0, start - 1)
+    if first > 0:
+        video_capture.set(cv2.CAP_PROP_POS_FRAMES, first)
+        if int(video_capture.get(cv2.CAP_PROP_POS_FRAMES)) != first:
+            video_capture.release()
+            video_capture = cv2.VideoCapture(path)
+            for _ in range(first):
+                video_capture.grab()
+
+    rows = []
+    previous = None
+    window = None
+    position = first
+    while stop is None or position < stop:
+        ret, frame = video_capture.read()
+        if not ret:
+            break
+
+        height = max(1, round(frame.shape[0] * width / frame.shape[1]))
+        gray = cv2.cvtColor(cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        current = gray.astype(np.float32)
+
+        if previous is None:
+            window = cv2.createHanningWindow((width, height), cv2.CV_32F)
+            (dx, dy), response = (0.0, 0.0), 0.0
+        else:
+            (dx, dy), response = cv2.phaseCorrelate(previous, current, window)
+
+        if position >= start:
+            histogram = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel()
+            rows.append((
+                position,
+                cv2.Laplacian(gray, cv2.CV_32F).var(),
+                gray.mean() / 255,
+                (histogram[:8].sum() + histogram[248:].sum()) / gray.size,
+                dx / width,
+                dy / height,
+                response,
+            ))
+
+        previous = current
+        position += 1
+
+    video_capture.release()
+    return np.array(rows, dtype=np.float64).reshape(-1, len(SCORE_FIELDS))
+
+def score_video(path, progress=None, executor=None, frames_per_segment=120, width=320):
+    frame_count = get_frame_count(path)
+
+    if frame_count <= 0:
+        segments = [(0, None)]
+    else:
+        segments = [(start, start + frames_per_segment) for start in range(0, frame_count, frames_per_segment)]
+        # frame counts can be estimates, let the last segment run until the video ends
+        segments[-1] = (segments[-1][0], None)
+
+    owns_executor = executor is None
+    if owns_executor:
+        executor = concurrent.futures.ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn"))
+
+    futures = [executor.submit(score_segment, path, start, stop, width) for start, stop in segments]
+
+    try:
+        for completed, _ in enumerate(concurrent.futures.as_completed(futures)):
+            if progress is not None:
+                progress((completed + 1) / len(futures))
+
+        scores = np.concatenate([future.result() for future in futures])
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+    finally:
+        if owns_executor:
+            executor.shutdown(cancel_futures=True)
+
+    return {field: scores[:, i] for i, field in enumerate(SCORE_FIELDS)}
+
+def select_keyframes(scores, target_overlap=0.7, min_sharpness=0.5, max_clipped=0.25, min_response=0.05, min_relative_sharpness=0.7):
+    frame_count = len(scores["index"])
+    if frame_count == 0:
+        return []
+
+    sharpness = scores["sharpness"]
+    usable = (
+        (sharpness >= np.median(sharpness) * min_sharpness)
+        & (scores["clipped"] <= max_clipped)
+        & (scores["brightness"] > 0.08)
+        & (scores["brightness"] < 0.92)
+    )
+    if not usable.any():
+        usable[:] = True
+
+    # positions in frame widths/heights, frames separated by an unreliable motion estimate never overlap
+    position_x = np.cumsum(scores["dx"])
+    position_y = np.cumsum(scores["dy"])
+    track = np.cumsum(scores["response"] < min_response)
+
+    def overlap_from(anchor):
+        overlap_x = np.clip(1 - np.abs(position_x[anchor + 1:] - position_x[anchor]), 0, 1)
+        overlap_y = np.clip(1 - np.abs(position_y[anchor + 1:] - position_y[anchor]), 0, 1)
+        overlap = overlap_x * overlap_y
+        overlap[track[anchor + 1:] != track[anchor]] = 0
+        return overlap
+
+    anchor = int(np.argmax(usable))
+    selected = [anchor]
+    while anchor + 1 < frame_count:
+        overlap = overlap_from(anchor)
+
+        # frames up to the first one that drops below the target overlap can all replace the next keyframe
+        below = overlap < target_overlap
+        window = int(np.argmax(below)) if below.any() else len(overlap)
+        candidates = np.flatnonzero(usable[anchor + 1:anchor + 1 + window])
+
+        if len(candidates) == 0:
+            remaining = np.flatnonzero(usable[anchor + 1:])
+            if len(remaining) == 0:
+                break
+            anchor = anchor + 1 + int(remaining[0])
+        elif window == len(overlap) and overlap[-1] > (1 + target_overlap) / 2:
+            # the rest of the video is still well covered by the current keyframe
+            break
+        else:
+            # the farthest frame keeps the set small, a nearer one only wins if that one is clearly blurrier
+            candidate_sharpness = sharpness[anchor + 1 + candidates]
+            sharp = candidates[candidate_sharpness >= candidate_sharpness.max() * min_relative_sharpness]
+            anchor = anchor + 1 + int(sharp[-1])
+
+        selected.append(anchor)
+
+    return [int(scores["index"][i]) for i in selected]
+
+def extract_keyframes(path, output_dir, target_overlap=0.7, image_format="PNG", level=None, progress=None, executor=None):
+    owns_executor = executor is None
+    if owns_executor:
+        executor = concurrent.futures.ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn"))
+
+    try:
+        scores = score_video(path, progress=progress and (lambda p: progress(p / 2)), executor=executor)
+        indices = select_keyframes(scores, target_overlap=target_overlap)
+
+        return extract_frames(
+            path,
+            output_dir,
+            indices=indices,
+            image_format=image_format,
+            level=level,
+            progress=progress and (lambda p: progress(0.5 + p / 2)),
+            executor=executor
+        )
+    finally:
+        if owns_executor:
+            executor.shutdown(cancel_futures=True)
@@ -0,0 +1,132 @@
+import array
+import bisect
+import csv
+import os
+import time
+
+class Histogram():
+    # log spaced buckets from 10us to ~10s, everything is preallocated so recording never allocates
+    bounds = [1e-5 * 1.25 ** i for i in range(63)]
+
+    def __init__(self):
+        self.counts = array.array("Q", [0] * (len(self.bounds) + 1))
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        if self.count == 0:
+            return 0.0
+
+        target = self.count * p / 100
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                # report the upper edge of the bucket, but never more than the largest value seen
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+class RateMeter():
+    def __init__(self, size=64):
+        self.times = array.array("d", [0.0] * size)
+        self.index = 0
+        self.count = 0
+
+    def tick(self, now=None):
+        self.times[self.index] = time.perf_counter() if now is None else now
+        self.index = (self.index + 1) % len(self.times)
+        self.count += 1
+
+    def get_rate(self, window=1.0):
+        now = time.perf_counter()
+        size = len(self.times)
+        newest = self.times[(self.index - 1) % size]
+        if self.count < 2 or now - newest > window:
+            return 0.0
+
+        # walk back over the ring until the window is covered
+        ticks = 1
+        oldest = newest
+        while ticks < min(self.count, size):
+            timestamp = self.times[(self.index - 1 - ticks) % size]
+            if now - timestamp > window:
+                break
+            oldest = timestamp
+            ticks += 1
+
+        return (ticks - 1) / (newest - oldest) if newest > oldest else 0.0
+
+class Metrics():
+    def __init__(self, name):
+        self.name = name
+        self.histograms = {}
+        self.rates = {}
+        self.counters = {}
+
+    def histogram(self, stage):
+        if stage not in self.histograms:
+            self.histograms[stage] = Histogram()
+        return self.histograms[stage]
+
+    def rate(self, stage):
+        if stage not in self.rates:
+            self.rates[stage] = RateMeter()
+        return self.rates[stage]
+
+    def add_counter(self, stage, function):
+        self.counters[stage] = function
+
+    def get_rows(self):
+        rows = []
+        for stage, histogram in list(self.histograms.items()):
+            rows.append({
+                "source": self.name,
+                "stage": stage,
+                "count": histogram.count,
+                "mean_ms": 1000 * histogram.mean(),
+                "p50_ms": 1000 * histogram.percentile(50),
+                "p99_ms": 1000 * histogram.percentile(99),
+                "max_ms": 1000 * histogram.max,
+            })
+
+        for stage, rate in list(self.rates.items()):
+            rows.append({"source": self.name, "stage": stage, "fps": rate.get_rate()})
+
+        for stage, function in list(self.counters.items()):
+            rows.append({"source": self.name, "stage": stage, "count": function()})
+
+        return rows
+
+CSV_FIELDS = ("time", "source", "stage", "count", "mean_ms", "p50_ms", "p99_ms", "max_ms", "fps")
+
+def write_csv(path, rows, append=False):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    write_header = not append or not os.path.exists(path)
+
+    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+    with open(path, "a" if append else "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=CSV_FIELDS)
+        if write_header:
+            writer.writeheader()
+
+        for row in rows:
+            writer.writerow({"time": timestamp, **row})
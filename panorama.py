@@ -0,0 +1,387 @@
+import concurrent.futures
+import math
+import os
+import queue
+import threading
+import numpy as np
+import cv2
+
+# frames are registered at this width, the full resolution frames are only touched by the final blend
+WORK_WIDTH = 480
+
+# focal length in image widths, there is no calibration yet
+FOCAL_FACTOR = 1.2
+
+# remap tables per (width, height, focal, scale), every frame of a sweep has the same size so this stays small
+spherical_maps = {}
+
+def translation(x, y):
+    return np.array([[1, 0, x], [0, 1, y], [0, 0, 1]], dtype=np.float64)
+
+def scaling(scale):
+    return np.diag([scale, scale, 1.0])
+
+def get_spherical_maps(width, height, focal, scale=1.0):
+    key = (width, height, focal, scale)
+    if key not in spherical_maps:
+        # angular extent of the frame, sampled at focal * scale pixels per radian
+        half_width = math.atan(width / 2 / focal)
+        half_height = math.atan(height / 2 / focal)
+        output_width = max(1, int(2 * half_width * focal * scale))
+        output_height = max(1, int(2 * half_height * focal * scale))
+
+        theta = (np.arange(output_width, dtype=np.float32) - output_width / 2) / (focal * scale)
+        phi = (np.arange(output_height, dtype=np.float32) - output_height / 2) / (focal * scale)
+        theta, phi = np.meshgrid(theta, phi)
+
+        map_x = (focal * np.tan(theta) + width / 2).astype(np.float32)
+        map_y = (focal * np.tan(phi) / np.cos(theta) + height / 2).astype(np.float32)
+        mask = ((map_x >= 0) & (map_x < width - 1) & (map_y >= 0) & (map_y < height - 1)).astype(np.uint8) * 255
+
+        if len(spherical_maps) > 8:
+            spherical_maps.clear()
+        spherical_maps[key] = (map_x, map_y, mask)
+
+    return spherical_maps[key]
+
+def warp_spherical(image, focal, scale=1.0):
+    height, width = image.shape[:2]
+    map_x, map_y, mask = get_spherical_maps(width, height, focal, scale)
+    return cv2.remap(image, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT), mask
+
+def estimate_transform(previous, current, focal, min_inliers=15):
+    # on a sphere a camera that only rotates moves the picture around, so a similarity transform is enough
+    previous, previous_mask = warp_spherical(previous, focal)
+    current, current_mask = warp_spherical(current, focal)
+
+    orb = cv2.ORB_create(1500)
+    previous_keypoints, previous_descriptors = orb.detectAndCompute(previous, cv2.erode(previous_mask, None, iterations=3))
+    current_keypoints, current_descriptors = orb.detectAndCompute(current, cv2.erode(current_mask, None, iterations=3))
+    if previous_descriptors is None or current_descriptors is None:
+        return None
+
+    matches = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True).match(current_descriptors, previous_descriptors)
+    if len(matches) < min_inliers:
+        return None
+
+    # centered coordinates, so transforms compose the same way whatever size the warped frames are
+    center = np.array(previous.shape[1::-1], dtype=np.float32) / 2
+    current_points = np.float32([current_keypoints[m.queryIdx].pt for m in matches]) - center
+    previous_points = np.float32([previous_keypoints[m.trainIdx].pt for m in matches]) - center
+
+    matrix, inliers = cv2.estimateAffinePartial2D(current_points, previous_points, method=cv2.RANSAC, ransacReprojThreshold=3.0)
+    if matrix is None or inliers.sum() < min_inliers:
+        return None
+
+    return np.vstack([matrix, [0, 0, 1]])
+
+class LiveStitcher():
+    # registered frames a new one is tried against, newest first, when it doesn't match its predecessor
+    match_window = 4
+
+    def __init__(self, executor, output_dir, preview_size=(1024, 512)):
+        self.executor = executor
+        self.output_dir = output_dir
+        self.focal = FOCAL_FACTOR * WORK_WIDTH
+
+        # 360 degrees across the preview, centered on the main chain's first frame
+        self.preview_size = preview_size
+        self.preview_scale = preview_size[0] / (2 * math.pi * self.focal)
+        self.preview = self.create_preview()
+        self.preview_version = 0
+
+        # every frame as [path, gray, chain, transform to its chain's centered spherical coordinates], a frame
+        # that matches nothing starts a chain of its own and chains are merged once a frame links them
+        self.registered = []
+        self.chains = {}
+        self.next_chain = 0
+        self.main_chain = None
+
+        self.count = 0
+        self.previous = None
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.integrate, name="stitcher", daemon=True)
+        self.thread.start()
+
+    @property
+    def frames(self):
+        # (path, transform) for the largest connected part of the sweep, what the final blend is made of
+        return [(entry[0], entry[3]) for entry in list(self.chains.get(self.main_chain, ()))]
+
+    @property
+    def gaps(self):
+        # runs of frames in arrival order that aren't part of the main chain, however many frames each lost
+        gaps = 0
+        in_main = True
+        for entry in list(self.registered):
+            if in_main and entry[2] != self.main_chain:
+                gaps += 1
+            in_main = entry[2] == self.main_chain
+        return gaps
+
+    def on_camera_frame(self, frame):
+        self.add_frame(cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR))
+
+    def add_frame(self, frame, path=None):
+        self.count += 1
+        if path is None:
+            path = os.path.join(self.output_dir, f"frame_{self.count}.jpg")
+            cv2.imwrite(path, frame, [cv2.IMWRITE_JPEG_QUALITY, 95])
+
+        small = self.get_small(frame)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+        # matching consecutive pairs doesn't depend on earlier results, so any number can be in flight
+        future = None
+        if self.previous is not None:
+            future = self.executor.submit(estimate_transform, self.previous, gray, self.focal)
+        self.previous = gray
+
+        self.queue.put((path, small, gray, future))
+
+    def get_small(self, frame):
+        height, width = frame.shape[:2]
+        return cv2.resize(frame, (WORK_WIDTH, max(1, round(height * WORK_WIDTH / width))), interpolation=cv2.INTER_AREA)
+
+    def finish(self):
+        self.queue.put(None)
+
+    def wait(self, timeout=None):
+        self.thread.join(timeout)
+        return not self.thread.is_alive()
+
+    def integrate(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+
+            path, small, gray, future = item
+            entry, merged = self.register(path, gray, future)
+            self.update_main_chain(entry, small, merged)
+
+        # a sweep that came back over earlier ground can still join chains that never met frame to frame
+        if self.link_chains():
+            self.update_main_chain(merged=True)
+
+    def register(self, path, gray, future):
+        # the predecessor is always the newest registered frame, its match is already in flight
+        matches = []
+        matched_chains = set()
+        for i, candidate in enumerate(reversed(self.registered[-self.match_window:])):
+            if candidate[2] in matched_chains:
+                continue
+
+            if i == 0:
+                relative = self.get_result(future)
+            else:
+                relative = self.get_result(self.executor.submit(estimate_transform, candidate[1], gray, self.focal))
+
+            if relative is not None:
+                matches.append((candidate, relative))
+                matched_chains.add(candidate[2])
+
+        if not matches:
+            entry = [path, gray, self.next_chain, np.eye(3)]
+            self.chains[self.next_chain] = [entry]
+            self.next_chain += 1
+            self.registered.append(entry)
+            return entry, False
+
+        candidate, relative = matches[0]
+        entry = [path, gray, candidate[2], candidate[3] @ relative]
+        self.chains[entry[2]].append(entry)
+        self.registered.append(entry)
+
+        # the new frame sits in more than one chain, which puts those chains in the same coordinates
+        merged = False
+        for candidate, relative in matches[1:]:
+            if candidate[2] == entry[2]:
+                continue
+
+            placed = candidate[3] @ relative
+            if candidate[2] < entry[2]:
+                self.merge(entry[2], candidate[2], placed @ np.linalg.inv(entry[3]))
+            else:
+                self.merge(candidate[2], entry[2], entry[3] @ np.linalg.inv(placed))
+            merged = True
+
+        return entry, merged
+
+    def merge(self, source, target, transform):
+        # older chains keep their coordinates, so the preview doesn't jump around
+        for entry in self.chains[source]:
+            entry[2] = target
+            entry[3] = transform @ entry[3]
+        self.chains[target] = self.chains[target] + self.chains.pop(source)
+
+    def link_chains(self, samples=3, targets=24):
+        linked = False
+        for chain in sorted(self.chains, key=lambda chain: -len(self.chains[chain])):
+            if chain == self.get_main_chain() or chain not in self.chains:
+                continue
+
+            main = self.chains[self.get_main_chain()]
+            sources = self.sample(self.chains[chain], samples)
+            candidates = self.sample(main, targets)
+            futures = [
+                (source, candidate, self.executor.submit(estimate_transform, candidate[1], source[1], self.focal))
+                for source in sources for candidate in candidates
+            ]
+
+            for source, candidate, future in futures:
+                relative = self.get_result(future)
+                if relative is not None and source[2] == chain:
+                    self.merge(chain, candidate[2], candidate[3] @ relative @ np.linalg.inv(source[3]))
+                    linked = True
+
+        return linked
+
+    def sample(self, entries, count):
+        step = max(1, len(entries) / count)
+        return [entries[int(i * step)] for i in range(min(count, len(entries)))]
+
+    def get_main_chain(self):
+        return max(self.chains, key=lambda chain: (len(self.chains[chain]), -chain))
+
+    def get_result(self, future):
+        if future is None:
+            return None
+
+        try:
+            return future.result()
+        except (concurrent.futures.CancelledError, cv2.error, RuntimeError) as e:
+            print(f"Stitching failed to match a frame: {e}")
+            return None
+
+    def update_main_chain(self, entry=None, small=None, merged=False):
+        main_chain = self.get_main_chain()
+        if main_chain != self.main_chain or (merged and (entry is None or entry[2] == main_chain)):
+            self.main_chain = main_chain
+            self.redraw_preview()
+        elif entry is not None and entry[2] == main_chain:
+            preview = self.preview.copy()
+            self.draw(preview, small, entry[3])
+            self.publish_preview(preview)
+
+    def create_preview(self):
+        preview = np.zeros((self.preview_size[1], self.preview_size[0], 4), dtype=np.uint8)
+        preview[..., 3] = 255
+        return preview
+
+    def redraw_preview(self):
+        # the main chain changed as a whole, its frames are read back from disk rather than kept in memory
+        preview = self.create_preview()
+        for path, transform in self.frames:
+            frame = cv2.imread(path)
+            if frame is not None:
+                self.draw(preview, self.get_small(frame), transform)
+        self.publish_preview(preview)
+
+    def publish_preview(self, preview):
+        # replaced as a whole so the UI can read it without a lock
+        self.preview = preview
+        self.preview_version += 1
+
+    def draw(self, preview, small, transform):
+        warped, mask = warp_spherical(small, self.focal)
+        preview_width, preview_height = self.preview_size
+        placement = (
+            translation(preview_width / 2, preview_height / 2)
+            @ scaling(self.preview_scale)
+            @ transform
+            @ translation(-warped.shape[1] / 2, -warped.shape[0] / 2)
+        )
+
+        # a sweep past 180 degrees either way wraps around the preview
+        for offset in (-preview_width, 0, preview_width):
+            matrix = (translation(offset, 0) @ placement)[:2]
+            drawn_mask = cv2.warpAffine(mask, matrix, self.preview_size, flags=cv2.INTER_NEAREST)
+            if not drawn_mask.any():
+                continue
+
+            drawn = cv2.warpAffine(warped, matrix, self.preview_size)
+            selected = drawn_mask > 0
+            preview[selected, 2::-1] = drawn[selected]
+
+def blend_panorama(frames, output_path, progress=None, max_width=6000):
+    if not frames:
+        raise ValueError("No registered frames to blend")
+
+    sample = cv2.imread(frames[0][0])
+    height, width = sample.shape[:2]
+    work_focal = FOCAL_FACTOR * WORK_WIDTH
+    focal = work_focal * width / WORK_WIDTH
+    full_scale = scaling(width / WORK_WIDTH)
+
+    # frame placements in full resolution centered coordinates and the bounds they cover
+    _, _, mask = get_spherical_maps(width, height, focal)
+    warped_height, warped_width = mask.shape
+    corners = np.array([[-warped_width / 2, -warped_height / 2, 1], [warped_width / 2, -warped_height / 2, 1],
+                        [warped_width / 2, warped_height / 2, 1], [-warped_width / 2, warped_height / 2, 1]]).T
+    placements = [full_scale @ transform @ np.linalg.inv(full_scale) for _, transform in frames]
+    bounds = np.hstack([(placement @ corners)[:2] for placement in placements])
+    minimum = bounds.min(axis=1)
+    maximum = bounds.max(axis=1)
+
+    scale = min(1.0, max_width / (maximum[0] - minimum[0]))
+    canvas_width = int(np.ceil((maximum[0] - minimum[0]) * scale)) + 1
+    canvas_height = int(np.ceil((maximum[1] - minimum[1]) * scale)) + 1
+    canvas = np.zeros((canvas_height, canvas_width, 3), dtype=np.float32)
+    weights = np.zeros((canvas_height, canvas_width), dtype=np.float32)
+
+    def warp_frame(path, placement):
+        warped, mask = warp_spherical(cv2.imread(path), focal, scale)
+        # feather towards the frame edges so seams fade instead of cutting
+        weight = cv2.distanceTransform(mask, cv2.DIST_L2, 3)
+        weight /= max(1.0, weight.max())
+
+        matrix = (
+            translation(-minimum[0] * scale, -minimum[1] * scale)
+            @ scaling(scale)
+            @ placement
+            @ scaling(1 / scale)
+            @ translation(-warped.shape[1] / 2, -warped.shape[0] / 2)
+        )
+
+        # only warp into the part of the canvas the frame actually covers
+        frame_corners = (matrix @ np.array([[0, warped.shape[1], warped.shape[1], 0], [0, 0, warped.shape[0], warped.shape[0]], [1, 1, 1, 1]]))[:2]
+        x0, y0 = np.maximum(np.floor(frame_corners.min(axis=1)).astype(int), 0)
+        x1, y1 = np.minimum(np.ceil(frame_corners.max(axis=1)).astype(int) + 1, [canvas_width, canvas_height])
+        matrix = (translation(-x0, -y0) @ matrix)[:2]
+
+        size = (int(x1 - x0), int(y1 - y0))
+        weight = cv2.warpAffine(weight, matrix, size)
+        warped = cv2.warpAffine(warped, matrix, size).astype(np.float32) * weight[..., None]
+        return x0, y0, warped, weight
+
+    completed = 0
+
+    def add_warped(future):
+        nonlocal completed
+        x0, y0, warped, weight = future.result()
+        canvas[y0:y0 + warped.shape[0], x0:x0 + warped.shape[1]] += warped
+        weights[y0:y0 + weight.shape[0], x0:x0 + weight.shape[1]] += weight
+
+        completed += 1
+        if progress is not None:
+            progress(completed / len(frames))
+
+    # OpenCV drops the GIL while warping, the blend itself stays on this thread
+    workers = max(1, min(4, os.cpu_count() or 1))
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        pending = set()
+        for (path, _), placement in zip(frames, placements):
+            # a warped full resolution frame is hundreds of MB in floats, so only a few are ever alive at once
+            if len(pending) >= 2 * workers:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    add_warped(future)
+
+            pending.add(executor.submit(warp_frame, path, placement))
+
+        for future in concurrent.futures.as_completed(pending):
+            add_warped(future)
+
+    np.divide(canvas, np.maximum(weights, 1e-6)[..., None], out=canvas)
+    cv2.imwrite(output_path, np.clip(canvas, 0, 255).astype(np.uint8))
@@ -0,0 +1,91 @@
+import collections
+import threading
+import time
+import cv2
+
+PreRollEntry = collections.namedtuple("PreRollEntry", ("timestamp", "keyframe", "data", "pts", "dts"))
+
+class PreRoll():
+    # the last few seconds of compressed frames, bounded by age and by total size
+    def __init__(self, seconds=30, max_bytes=256 * 2 ** 20):
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self.caps = None
+
+        self.entries = collections.deque()
+        # the buffered keyframes, oldest first, so whole groups of pictures can be dropped at once
+        self.keyframes = collections.deque()
+        self.size = 0
+        self.trimmed = 0
+        self.listeners = []
+        self.lock = threading.Lock()
+
+    def append(self, entry):
+        with self.lock:
+            self.entries.append(entry)
+            self.size += len(entry.data)
+            if entry.keyframe:
+                self.keyframes.append(entry)
+            self.trim(entry.timestamp)
+
+            # listeners are called under the lock so none of them can see an entry twice or out of order
+            for listener in self.listeners:
+                listener(entry)
+
+    def trim(self, now):
+        # a recording has to start on something that decodes on its own
+        while self.entries and not self.entries[0].keyframe:
+            self.pop()
+
+        # a group of pictures only goes once the next one starts early enough to cover the whole window on its
+        # own, and the newest keyframe and what follows it always stay, so a recording can start without waiting
+        while len(self.keyframes) > 1 and (self.size > self.max_bytes or self.keyframes[1].timestamp <= now - self.seconds):
+            self.keyframes.popleft()
+            while self.entries[0] is not self.keyframes[0]:
+                self.pop()
+
+    def pop(self):
+        entry = self.entries.popleft()
+        self.size -= len(entry.data)
+        self.trimmed += 1
+
+    def attach(self, listener):
+        # hands over everything buffered so far and then every new entry, without a gap in between
+        with self.lock:
+            for entry in self.entries:
+                listener(entry)
+            self.listeners = self.listeners + [listener]
+
+    def detach(self, listener):
+        with self.lock:
+            self.listeners = [l for l in self.listeners if l != listener]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.keyframes.clear()
+            self.size = 0
+            self.caps = None
+
+    def get_duration(self):
+        entries = self.entries
+        return entries[-1].timestamp - entries[0].timestamp if len(entries) > 1 else 0.0
+
+class JpegPreRoll(PreRoll):
+    def __init__(self, camera, seconds=30, max_bytes=256 * 2 ** 20, frame_rate=30, quality=85):
+        super().__init__(seconds, max_bytes)
+        self.camera = camera
+        self.frame_rate = frame_rate
+        self.params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+
+        # encoding happens on the subscriber's own thread and only ever on the newest frame
+        self.subscriber = camera.add_callback(self.on_new_frame, policy="latest", frame_rate=frame_rate)
+
+    def close(self):
+        self.camera.remove_callback(self.subscriber, drain=False)
+
+    def on_new_frame(self, frame):
+        timestamp = time.monotonic()
+        success, data = cv2.imencode(".jpg", cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR), self.params)
+        if success:
+            self.append(PreRollEntry(timestamp, True, data.tobytes(), None, None))
@@ -0,0 +1,375 @@
+import concurrent.futures
+import ctypes
+import multiprocessing
+import os
+import sys
+import time
+import numpy as np
+import cv2
+
+from extraction import list_frames
+
+class RealityKitBackend():
+    name = "RealityKit"
+
+    def __init__(self, path="libpgm.dylib"):
+        self.lib = ctypes.cdll.LoadLibrary(path)
+
+        self.lib.run_photogrammetry_session.argtypes = [ctypes.c_char_p]
+        self.lib.run_photogrammetry_session.restype = None
+
+        self.lib.is_completed.argtypes = []
+        self.lib.is_completed.restype = ctypes.c_bool
+
+        self.lib.get_progress.argtypes = []
+        self.lib.get_progress.restype = ctypes.c_double
+
+        self.lib.get_eta.argtypes = []
+        self.lib.get_eta.restype = ctypes.c_double
+
+        self.lib.stop_photogrammetry_session.argtypes = []
+        self.lib.stop_photogrammetry_session.restype = None
+
+    def run_photogrammetry_session(self, images_path):
+        self.lib.run_photogrammetry_session(images_path.encode())
+
+    def is_completed(self):
+        return self.lib.is_completed()
+
+    def get_progress(self):
+        return self.lib.get_progress()
+
+    def get_eta(self):
+        return self.lib.get_eta()
+
+    def stop_photogrammetry_session(self):
+        self.lib.stop_photogrammetry_session()
+
+    def get_error(self):
+        # the session reports failures through its own logging, there's nothing to read back
+        return None
+
+class OpenCVBackend():
+    name = "OpenCV"
+
+    def __init__(self):
+        self.context = multiprocessing.get_context("spawn")
+        self.progress = self.context.Value(ctypes.c_double, 0.0, lock=False)
+        self.eta = self.context.Value(ctypes.c_double, 0.0, lock=False)
+        self.completed = self.context.Value(ctypes.c_bool, False, lock=False)
+        self.error = self.context.Array(ctypes.c_char, 512, lock=False)
+        self.cancel_event = self.context.Event()
+        self.process = None
+
+    def run_photogrammetry_session(self, images_path):
+        self.stop_photogrammetry_session()
+
+        self.progress.value = 0.0
+        self.eta.value = 0.0
+        self.completed.value = False
+        self.error.value = b""
+        self.cancel_event.clear()
+
+        # a process of its own keeps the UI responsive and lets a stop kill it outright if it has to
+        self.process = self.context.Process(
+            target=run_reconstruction,
+            args=(images_path, self.progress, self.eta, self.completed, self.error, self.cancel_event),
+            name="reconstruction",
+            daemon=True
+        )
+        self.process.start()
+
+    def is_completed(self):
+        return self.completed.value
+
+    def get_progress(self):
+        return self.progress.value
+
+    def get_eta(self):
+        return self.eta.value
+
+    def get_error(self):
+        if self.error.value:
+            return self.error.value.decode(errors="replace")
+
+        # killed before it could say why, e.g. by the OOM killer
+        process = self.process
+        if process is not None and process.exitcode not in (None, 0) and not self.completed.value:
+            return f"Reconstruction exited with code {process.exitcode}"
+
+        return None
+
+    def stop_photogrammetry_session(self):
+        if self.process is None:
+            return
+
+        self.cancel_event.set()
+        self.process.join(2)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.process = None
+
+        if not self.completed.value:
+            self.progress.value = 0.0
+            self.eta.value = 0.0
+
+BACKENDS = {
+    "realitykit": RealityKitBackend,
+    "opencv": OpenCVBackend,
+}
+
+def create_backend(name=None):
+    name = name or os.environ.get("MATE_RECONSTRUCTION")
+    if name is not None:
+        if name.lower() not in BACKENDS:
+            raise ValueError(f"Unknown reconstruction backend {name}, expected one of {', '.join(BACKENDS)}")
+        return BACKENDS[name.lower()]()
+
+    if sys.platform == "darwin":
+        try:
+            return RealityKitBackend()
+        except OSError as e:
+            print(f"RealityKit backend unavailable, using OpenCV: {e}")
+
+    return OpenCVBackend()
+
+class ReconstructionCancelled(Exception):
+    pass
+
+class ProgressTracker():
+    def __init__(self, progress, eta, cancel_event):
+        self.progress = progress
+        self.eta = eta
+        self.cancel_event = cancel_event
+        self.start = time.perf_counter()
+
+    def phase(self, start, end):
+        return lambda fraction: self.report(start + (end - start) * fraction)
+
+    def report(self, fraction):
+        if self.cancel_event.is_set():
+            raise ReconstructionCancelled()
+
+        self.progress.value = fraction
+        if fraction > 0:
+            elapsed = time.perf_counter() - self.start
+            self.eta.value = elapsed * (1 - fraction) / fraction
+
+def detect_features(path, max_size=1600, max_features=4000):
+    image = cv2.imread(path)
+    if image is None:
+        return None
+
+    scale = min(1.0, max_size / max(image.shape[:2]))
+    if scale < 1.0:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    keypoints, descriptors = cv2.SIFT_create(max_features).detectAndCompute(gray, None)
+    if descriptors is None:
+        keypoints, descriptors = [], np.zeros((0, 128), dtype=np.float32)
+
+    points = np.array([keypoint.pt for keypoint in keypoints], dtype=np.float32).reshape(-1, 2)
+    pixels = np.clip(np.round(points).astype(int), 0, [image.shape[1] - 1, image.shape[0] - 1])
+    colors = image[pixels[:, 1], pixels[:, 0], ::-1] if len(points) else np.zeros((0, 3), dtype=np.uint8)
+
+    return {"size": image.shape[1::-1], "points": points, "descriptors": descriptors, "colors": colors}
+
+def match_pair(first, second, camera_matrix, ratio=0.75, min_matches=30):
+    if len(first["points"]) < min_matches or len(second["points"]) < min_matches:
+        return None
+
+    matcher = cv2.FlannBasedMatcher({"algorithm": 1, "trees": 4}, {"checks": 64})
+    knn = matcher.knnMatch(first["descriptors"], second["descriptors"], k=2)
+    matches = np.array(
+        [(m.queryIdx, m.trainIdx) for m, *rest in (pair for pair in knn if pair) if not rest or m.distance < ratio * rest[0].distance],
+        dtype=np.int32
+    ).reshape(-1, 2)
+    if len(matches) < min_matches:
+        return None
+
+    # keep only matches consistent with a single relative camera motion
+    _, inliers = cv2.findEssentialMat(
+        first["points"][matches[:, 0]], second["points"][matches[:, 1]], camera_matrix, method=cv2.RANSAC, prob=0.999, threshold=1.5
+    )
+    if inliers is None:
+        return None
+
+    matches = matches[inliers.ravel() > 0]
+    return matches if len(matches) >= min_matches else None
+
+def triangulate(camera_matrix, first_pose, second_pose, first_points, second_points, max_error=4.0, min_angle=1.0):
+    first_projection = camera_matrix @ first_pose
+    second_projection = camera_matrix @ second_pose
+
+    homogeneous = cv2.triangulatePoints(first_projection, second_projection, first_points.T, second_points.T)
+    points = (homogeneous[:3] / homogeneous[3]).T
+
+    valid = np.isfinite(points).all(axis=1)
+    for pose, projection, observed in ((first_pose, first_projection, first_points), (second_pose, second_projection, second_points)):
+        depth = (pose[:, :3] @ points.T + pose[:, 3:]).T[:, 2]
+        projected = (projection @ np.hstack([points, np.ones((len(points), 1))]).T).T
+        error = np.linalg.norm(projected[:, :2] / projected[:, 2:] - observed, axis=1)
+        valid &= (depth > 0) & (error < max_error)
+
+    # rays that are nearly parallel give points with wildly uncertain depth
+    first_center = -first_pose[:, :3].T @ first_pose[:, 3]
+    second_center = -second_pose[:, :3].T @ second_pose[:, 3]
+    first_rays = points - first_center
+    second_rays = points - second_center
+    cosine = (first_rays * second_rays).sum(axis=1) / (np.linalg.norm(first_rays, axis=1) * np.linalg.norm(second_rays, axis=1) + 1e-12)
+    valid &= cosine < np.cos(np.radians(min_angle))
+
+    return points, valid
+
+def reconstruct(features, matches, camera_matrix, progress=None, window=5, min_initial_points=50):
+    # incremental structure from motion along the capture order, every frame is registered against the ones before it
+    poses = {}
+    track_points = [dict() for _ in features]
+    points = []
+    colors = []
+
+    def add_points(first, second, pair_matches):
+        unassigned = np.array([
+            (a, b) for a, b in pair_matches if a not in track_points[first] and b not in track_points[second]
+        ], dtype=np.int32).reshape(-1, 2)
+        if len(unassigned) == 0:
+            return
+
+        new_points, valid = triangulate(
+            camera_matrix, poses[first], poses[second],
+            features[first]["points"][unassigned[:, 0]], features[second]["points"][unassigned[:, 1]]
+        )
+        for (a, b), point in zip(unassigned[valid], new_points[valid]):
+            track_points[first][a] = len(points)
+            track_points[second][b] = len(points)
+            points.append(point)
+            colors.append(features[second]["colors"][b])
+
+    identity = np.hstack([np.eye(3), np.zeros((3, 1))])
+    origin = None
+
+    for index in range(len(features)):
+        if progress is not None:
+            progress(index / len(features))
+
+        if origin is None:
+            origin = index
+            poses[index] = identity
+            continue
+
+        if len(poses) == 1:
+            # the first pair with enough parallax fixes the scale of everything after it
+            pair = matches.get((origin, index))
+            if pair is not None:
+                first_points = features[origin]["points"][pair[:, 0]]
+                second_points = features[index]["points"][pair[:, 1]]
+                essential, _ = cv2.findEssentialMat(first_points, second_points, camera_matrix, method=cv2.RANSAC, prob=0.999, threshold=1.5)
+                _, rotation, translation, _ = cv2.recoverPose(essential[:3], first_points, second_points, camera_matrix)
+                poses[index] = np.hstack([rotation, translation])
+                add_points(origin, index, pair)
+                if len(points) >= min_initial_points:
+                    continue
+
+                del poses[index]
+                track_points[origin] = {}
+                track_points[index] = {}
+                points.clear()
+                colors.clear()
+
+            if index - origin >= window:
+                # nothing near the start overlaps it well enough, start over from here
+                del poses[origin]
+                origin = index
+                poses[index] = identity
+            continue
+
+        previous = [(other, pair) for (other, current), pair in matches.items() if current == index and other in poses]
+
+        correspondences = {}
+        for other, pair in previous:
+            for a, b in pair:
+                point = track_points[other].get(a)
+                if point is not None:
+                    correspondences.setdefault(b, point)
+
+        if len(correspondences) < 12:
+            # lost track, this frame can't be placed
+            continue
+
+        keypoints = np.array(list(correspondences.keys()), dtype=np.int32)
+        object_points = np.array([points[point] for point in correspondences.values()], dtype=np.float64)
+        found, rotation_vector, translation, inliers = cv2.solvePnPRansac(
+            object_points, features[index]["points"][keypoints].astype(np.float64),
+            camera_matrix, None, reprojectionError=4.0, confidence=0.999
+        )
+        if not found or inliers is None or len(inliers) < 12:
+            continue
+
+        poses[index] = np.hstack([cv2.Rodrigues(rotation_vector)[0], translation])
+        for i in inliers.ravel():
+            track_points[index][keypoints[i]] = correspondences[keypoints[i]]
+        for other, pair in previous:
+            add_points(other, index, pair)
+
+    return np.array(points, dtype=np.float64).reshape(-1, 3), np.array(colors, dtype=np.uint8).reshape(-1, 3), poses
+
+def write_obj(path, points, colors):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # vertex colours after the position are understood by MeshLab and most other viewers
+    with open(path, "w") as file:
+        file.write(f"# {len(points)} points\n")
+        for (x, y, z), (r, g, b) in zip(points, colors):
+            file.write(f"v {x:.6f} {-y:.6f} {-z:.6f} {r / 255:.4f} {g / 255:.4f} {b / 255:.4f}\n")
+
+def run_reconstruction(images_path, progress, eta, completed, error, cancel_event, window=5):
+    tracker = ProgressTracker(progress, eta, cancel_event)
+
+    try:
+        images = list_frames(images_path)
+        if len(images) < 2:
+            raise ValueError(f"Need at least two images in {images_path}, found {len(images)}")
+
+        # OpenCV drops the GIL while detecting and matching, so threads keep every core busy without pickling features
+        with concurrent.futures.ThreadPoolExecutor(os.cpu_count()) as executor:
+            report = tracker.phase(0.0, 0.4)
+            futures = [executor.submit(detect_features, image) for image in images]
+            for completed_count, _ in enumerate(concurrent.futures.as_completed(futures)):
+                report((completed_count + 1) / len(futures))
+            features = [feature for feature in (future.result() for future in futures) if feature is not None]
+            if len(features) < 2:
+                raise ValueError(f"Only {len(features)} of {len(images)} images in {images_path} could be read")
+
+            # no calibration yet, assume a typical field of view and a centered principal point
+            width, height = features[0]["size"]
+            focal = 1.2 * max(width, height)
+            camera_matrix = np.array([[focal, 0, width / 2], [0, focal, height / 2], [0, 0, 1]], dtype=np.float64)
+
+            # frames come from one continuous recording, so only neighbours within a short window can overlap
+            report = tracker.phase(0.4, 0.7)
+            pairs = [(i, j) for i in range(len(features)) for j in range(i + 1, min(i + 1 + window, len(features)))]
+            futures = {executor.submit(match_pair, features[i], features[j], camera_matrix): (i, j) for i, j in pairs}
+            matches = {}
+            for completed_count, future in enumerate(concurrent.futures.as_completed(futures)):
+                pair = future.result()
+                if pair is not None:
+                    matches[futures[future]] = pair
+                report((completed_count + 1) / len(futures))
+
+        matches = dict(sorted(matches.items()))
+        points, colors, poses = reconstruct(features, matches, camera_matrix, tracker.phase(0.7, 0.98), window)
+
+        print(f"Registered {len(poses)} of {len(features)} frames, {len(points)} points")
+        write_obj(os.path.join(images_path, "model", "out.obj"), points, colors)
+
+        progress.value = 1.0
+        eta.value = 0.0
+        completed.value = True
+    except ReconstructionCancelled:
+        print("Reconstruction was cancelled")
+    except Exception as e:
+        # anything that ends the process, the UI only sees the shared values so the reason has to go through them too
+        print(f"Reconstruction failed: {e}")
+        error.value = f"{type(e).__name__}: {e}".encode()[:511]
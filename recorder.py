@@ -0,0 +1,225 @@
+import os
+import queue
+import threading
+import numpy as np
+import cv2
+from gi.repository import Gst
+
+def find_recording(directory):
+    for name in ("video.mkv", "video.mp4", "video.avi"):
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            return path
+
+    return os.path.join(directory, "video.avi")
+
+class Recorder():
+    def __init__(self, camera, path, frame_rate=30, fourcc="MJPG", max_frames=60):
+        self.camera = camera
+        self.path = path
+        self.frame_rate = frame_rate
+        self.fourcc = fourcc
+        self.max_frames = max_frames
+
+        self.video_writer = None
+        self.frame_size = None
+        self.frames_written = 0
+
+        self.subscriber = None
+        self.preroll = None
+        self.entries = None
+        self.dropped = 0
+        self.finished = threading.Event()
+
+    def start(self):
+        self.preroll = self.camera.preroll
+        if self.preroll is not None:
+            # room for the whole backlog, past that live entries get the same bounded queue as frames do
+            entries = self.entries = queue.Queue(len(self.preroll.entries) + self.max_frames)
+            self.preroll.attach(self.on_entry)
+            threading.Thread(target=self.write_entries, args=(entries,), daemon=True).start()
+            return
+
+        self.subscriber = self.camera.add_callback(
+            self.on_new_frame,
+            policy="queue",
+            max_frames=self.max_frames,
+            frame_rate=self.frame_rate
+        )
+        self.subscriber.on_close = self.release
+
+    def stop(self):
+        # returns straight away, the queue drains and then the writer is released
+        if self.entries is not None:
+            self.preroll.detach(self.on_entry)
+            self.entries.put(None)
+            self.entries = None
+        elif self.subscriber is not None:
+            self.camera.remove_callback(self.subscriber, drain=True)
+
+    def is_recording(self):
+        if self.preroll is not None:
+            return self.entries is not None
+        return self.subscriber is not None and not self.subscriber.closed
+
+    def is_finished(self):
+        return self.finished.is_set()
+
+    def wait(self, timeout=None):
+        return self.finished.wait(timeout)
+
+    def get_dropped_frames(self):
+        if self.preroll is not None:
+            return self.dropped
+        return self.subscriber.dropped if self.subscriber is not None else 0
+
+    def on_entry(self, entry):
+        # called from the pre-roll's writer, which must never wait for the disk
+        try:
+            self.entries.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def write_entries(self, entries):
+        interval = 1 / self.frame_rate
+        next_frame_time = None
+
+        while True:
+            entry = entries.get()
+            if entry is None:
+                break
+
+            # the pre-roll may run at a higher rate than this recording
+            if next_frame_time is not None and entry.timestamp < next_frame_time - interval / 4:
+                continue
+            next_frame_time = max(next_frame_time or 0, entry.timestamp - interval / 4) + interval
+
+            frame = cv2.imdecode(np.frombuffer(entry.data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if frame is not None:
+                self.write_frame(frame)
+
+        self.release()
+
+    def on_new_frame(self, frame):
+        self.write_frame(cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR))
+
+    def write_frame(self, frame):
+        height, width = frame.shape[:2]
+
+        if self.video_writer is None:
+            # take the size from the stream caps instead of assuming one
+            self.frame_size = (width, height)
+            self.video_writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self.fourcc), self.frame_rate, self.frame_size)
+
+        if (width, height) != self.frame_size:
+            frame = cv2.resize(frame, self.frame_size, interpolation=cv2.INTER_AREA)
+
+        self.video_writer.write(frame)
+        self.frames_written += 1
+
+    def release(self):
+        if self.video_writer is not None:
+            self.video_writer.release()
+            self.video_writer = None
+
+        self.finished.set()
+
+class PassthroughRecorder():
+    muxers = {
+        ".mkv": "matroskamux",
+        ".mp4": "mp4mux",
+    }
+
+    def __init__(self, camera, path):
+        self.camera = camera
+        self.path = path
+
+        self.pipeline = None
+        self.source = None
+        self.preroll = None
+        self.entries = None
+        self.base_time = None
+        self.recording = False
+        self.finished = threading.Event()
+
+    def start(self):
+        muxer = self.muxers[os.path.splitext(self.path)[1]]
+        preroll = self.preroll = self.camera.h264_preroll
+
+        # a pipeline of its own, fed from the pre-roll, so it never has to be spliced into the camera's
+        self.pipeline = Gst.parse_launch(f"appsrc name=source format=time ! h264parse ! {muxer} ! filesink name=filesink")
+        self.pipeline.get_by_name("filesink").set_property("location", self.path)
+        self.source = self.pipeline.get_by_name("source")
+        self.pipeline.set_state(Gst.State.PLAYING)
+
+        self.entries = queue.Queue()
+        preroll.attach(self.entries.put)
+        self.recording = True
+        self.camera.rebuild_callbacks.append(self.on_camera_rebuild)
+
+        threading.Thread(target=self.push_entries, args=(preroll, self.entries), daemon=True).start()
+
+    def stop(self):
+        if not self.recording:
+            return
+
+        self.recording = False
+        if self.on_camera_rebuild in self.camera.rebuild_callbacks:
+            self.camera.rebuild_callbacks.remove(self.on_camera_rebuild)
+
+        self.preroll.detach(self.entries.put)
+        self.entries.put(None)
+
+    def is_recording(self):
+        return self.recording
+
+    def is_finished(self):
+        return self.finished.is_set()
+
+    def wait(self, timeout=None):
+        return self.finished.wait(timeout)
+
+    def on_camera_rebuild(self):
+        # timestamps start over in the new pipeline, so the recording ends with the old one
+        self.stop()
+
+    def push_entries(self, preroll, entries):
+        while True:
+            entry = entries.get()
+            if entry is None:
+                break
+
+            if self.base_time is None:
+                # a file that starts on a delta frame can't be decoded until the next keyframe
+                if not entry.keyframe:
+                    continue
+                self.base_time = entry.dts if entry.dts != Gst.CLOCK_TIME_NONE else entry.pts
+                self.source.set_property("caps", Gst.Caps.from_string(preroll.caps))
+
+            buffer = Gst.Buffer.new_wrapped(entry.data)
+            buffer.pts = self.rebase(entry.pts)
+            buffer.dts = self.rebase(entry.dts)
+            if not entry.keyframe:
+                buffer.set_flags(Gst.BufferFlags.DELTA_UNIT)
+            self.source.emit("push-buffer", buffer)
+
+        self.source.emit("end-of-stream")
+        self.release()
+
+    def rebase(self, timestamp):
+        if timestamp == Gst.CLOCK_TIME_NONE or timestamp < self.base_time:
+            return Gst.CLOCK_TIME_NONE
+        return timestamp - self.base_time
+
+    def release(self):
+        # the muxer has to see end of stream before its trailer is written
+        bus = self.pipeline.get_bus()
+        message = bus.timed_pop_filtered(5 * Gst.SECOND, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+        if message is not None and message.type == Gst.MessageType.ERROR:
+            print(f"Passthrough recording failed: {message.parse_error()[0]}")
+
+        self.pipeline.set_state(Gst.State.NULL)
+        self.pipeline = None
+        self.source = None
+
+        self.finished.set()
@@ -0,0 +1,97 @@
+import threading
+import time
+
+class Task():
+    def __init__(self, name, callback, rate, essential, histogram):
+        self.name = name
+        self.callback = callback
+        # None runs the task on every rendered frame
+        self.interval = 1 / rate if rate else 0.0
+        self.essential = essential
+        self.histogram = histogram
+        self.next_run = 0.0
+        self.deferred = 0
+
+class Scheduler():
+    # decides when the UI renders a frame and which panel updates run in it
+    def __init__(self, metrics, budget=0.008, idle_rate=15, active_time=0.5):
+        self.metrics = metrics
+        # time per frame for the updates that can wait, essential ones like camera textures always run
+        self.budget = budget
+        # input is only polled while rendering, so an idle UI still has to render this often to notice any
+        self.idle_interval = 1 / idle_rate
+        # after input the UI renders every frame for a while, so dragging and typing stay smooth
+        self.active_time = active_time
+
+        self.tasks = []
+        self.wake_event = threading.Event()
+        self.active_until = 0.0
+        self.last_render = 0.0
+
+        self.deferred = 0
+        self.wait_time = metrics.histogram("scheduler idle")
+        metrics.add_counter("scheduler deferred", lambda: self.deferred)
+
+    def add(self, name, callback, rate=None, essential=False):
+        task = Task(name, callback, rate, essential, self.metrics.histogram(name))
+        self.tasks.append(task)
+        return task
+
+    def remove(self, task):
+        self.tasks = [t for t in self.tasks if t is not task]
+
+    def wake(self):
+        # safe to call from any thread, e.g. a pipeline that just delivered a frame
+        self.wake_event.set()
+
+    def on_input(self, *_):
+        self.active_until = time.perf_counter() + self.active_time
+        self.wake_event.set()
+
+    def get_timeout(self, now):
+        if now < self.active_until:
+            return 0.0
+
+        next_run = self.last_render + self.idle_interval
+        for task in self.tasks:
+            if task.interval:
+                next_run = min(next_run, task.next_run)
+        return max(0.0, next_run - now)
+
+    def wait(self):
+        # blocks until there's something to render: a new camera frame, input, a due task or the idle refresh
+        start = time.perf_counter()
+        timeout = self.get_timeout(start)
+        if timeout > 0:
+            self.wake_event.wait(timeout)
+        self.wake_event.clear()
+
+        now = time.perf_counter()
+        self.wait_time.record(now - start)
+        self.last_render = now
+        return now
+
+    def run(self, now=None):
+        now = time.perf_counter() if now is None else now
+        due = [task for task in self.tasks if task.next_run <= now]
+
+        # essential tasks first, then whatever has waited longest past its due time
+        due.sort(key=lambda task: (not task.essential, task.next_run))
+        budget_end = now + self.budget
+
+        ran_optional = False
+        for task in due:
+            start = time.perf_counter()
+            # at least one update that can wait runs every frame, so nothing waits forever behind slow cameras
+            if not task.essential and ran_optional and start > budget_end:
+                # stays due, so it's near the front next frame
+                task.deferred += 1
+                self.deferred += 1
+                continue
+
+            task.callback()
+            ran_optional = ran_optional or not task.essential
+            done = time.perf_counter()
+            task.histogram.record(done - start)
+            # scheduled from when it was due so rates don't drift, but never to catch up on missed runs
+            task.next_run = max(task.next_run + task.interval, done) if task.interval else done
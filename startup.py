@@ -0,0 +1,27 @@
+import contextlib
+import threading
+import time
+
+class StartupTrace():
+    def __init__(self):
+        self.start = time.perf_counter()
+        # (name, start, duration, thread) relative to when the trace was created, appended from any thread
+        self.spans = []
+        self.reported = False
+
+    @contextlib.contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.append((name, start - self.start, time.perf_counter() - start, threading.current_thread().name))
+
+    def mark(self, name):
+        self.spans.append((name, time.perf_counter() - self.start, 0.0, threading.current_thread().name))
+
+    def report(self):
+        self.reported = True
+        print("Startup trace (start ms, duration ms, thread):")
+        for name, start, duration, thread in sorted(self.spans, key=lambda span: span[1]):
+            print(f"  {1000 * start:8.1f} {1000 * duration:8.1f}  {thread:<16} {name}")
@@ -0,0 +1,367 @@
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+Gst.init(None)
+
+import threading
+import time
+import numpy as np
+
+from frame_bus import FrameBus
+from metrics import Metrics
+from preroll import PreRoll, PreRollEntry, JpegPreRoll
+
+PROFILES = {
+    # no jitter buffer and a single buffer appsink, a late frame is dropped rather than waited for
+    "lowest-latency": {
+        "codec": "H264",
+        "jitter_latency": None,
+        "max_buffers": 1,
+        "drop": True,
+        "sync": False,
+        "decoder_threads": 0,
+        "slice_threads": True,
+        "convert_threads": 0,
+        "pull_thread": True,
+    },
+    "balanced": {
+        "codec": "H264",
+        "jitter_latency": 30,
+        "max_buffers": 2,
+        "drop": True,
+        "sync": False,
+        "decoder_threads": 0,
+        "slice_threads": False,
+        "convert_threads": 2,
+        "pull_thread": True,
+    },
+    # enough jitter buffer to reorder late packets and ride out bursts of delay on a noisy tether, lost packets
+    # stay lost since there's no RTCP back to the sender to ask for retransmits
+    "lossy-link": {
+        "codec": "H264",
+        "jitter_latency": 200,
+        "max_buffers": 4,
+        "drop": True,
+        "sync": False,
+        "decoder_threads": 0,
+        "slice_threads": False,
+        "convert_threads": 2,
+        "pull_thread": False,
+    },
+    "jpeg": {
+        "codec": "JPEG",
+        "jitter_latency": None,
+        "max_buffers": 1,
+        "drop": True,
+        "sync": False,
+        "decoder_threads": 0,
+        "slice_threads": False,
+        "convert_threads": 2,
+        "pull_thread": True,
+    },
+}
+
+DEFAULT_PROFILE = "lowest-latency"
+
+def build_pipeline_description(port, profile):
+    settings = PROFILES[profile]
+
+    if settings["codec"] == "H264":
+        caps = "application/x-rtp,media=video,clock-rate=90000,encoding-name=H264"
+        # the parsed access units are what the pre-roll and passthrough recordings store
+        depay = "rtph264depay name=depay ! h264parse name=parse config-interval=-1 ! queue"
+        # frame threading holds back one frame per thread, slice threading doesn't
+        thread_type = " thread-type=slice" if settings["slice_threads"] else ""
+        decoder = f"avdec_h264 name=decoder max-threads={settings['decoder_threads']}{thread_type}"
+    elif settings["codec"] == "JPEG":
+        caps = "application/x-rtp,media=video,clock-rate=90000,encoding-name=JPEG,payload=26"
+        depay = "rtpjpegdepay name=depay"
+        decoder = "jpegdec name=decoder"
+    else:
+        raise ValueError(f"Unknown codec {settings['codec']}")
+
+    jitter_buffer = ""
+    if settings["jitter_latency"] is not None:
+        jitter_buffer = f"rtpjitterbuffer latency={settings['jitter_latency']} drop-on-latency=true ! "
+
+    convert = "videoconvert"
+    if settings["convert_threads"]:
+        convert = f"videoconvert n-threads={settings['convert_threads']}"
+
+    sink = (
+        f"appsink name=sink max-buffers={settings['max_buffers']} drop={str(settings['drop']).lower()} "
+        f"sync={str(settings['sync']).lower()} emit-signals={str(not settings['pull_thread']).lower()}"
+    )
+
+    return (
+        f"udpsrc port={port} caps=\"{caps}\" ! {jitter_buffer}{depay} ! {decoder} ! "
+        f"{convert} ! video/x-raw,format=RGBA ! {sink}"
+    )
+
+class FrameSource():
+    # what panels and recorders see of a camera, wherever its pipeline actually runs
+
+    # whether latest frames are views of memory another process keeps writing to
+    shared_frames = False
+
+    def __init__(self, port, metrics=None):
+        self.port = port
+        self.profile = None
+
+        # called before the pipeline is torn down, e.g. so passthrough recordings can finish their file
+        self.rebuild_callbacks = []
+
+        self.frame_bus = FrameBus()
+        self.latest_frame = (0, None)
+        self.metrics = Metrics(f"Camera {port}") if metrics is None else metrics
+
+        # called on the delivering thread for every new latest frame, they must not do more than wake someone up
+        self.frame_listeners = []
+
+        # compressed copies of the last few seconds, so a recording can start before record was pressed
+        self.preroll = None
+        self.preroll_settings = None
+
+    def supports_passthrough(self):
+        return False
+
+    def is_frame_current(self, sequence):
+        # whether the latest frame with this sequence still holds what it did, only shared memory gets reused
+        return True
+
+    def set_latest_frame(self, sequence, frame):
+        self.latest_frame = (sequence, frame)
+        for listener in self.frame_listeners:
+            listener()
+
+    def enable_preroll(self, seconds=30, max_bytes=256 * 2 ** 20, frame_rate=30):
+        self.preroll_settings = (seconds, max_bytes, frame_rate)
+        self.metrics.add_counter("pre-roll MB", lambda: self.preroll.size / 2 ** 20 if self.preroll is not None else 0)
+        self.update_preroll()
+
+    def update_preroll(self):
+        # only decoded frames reach this process, so they're encoded again whatever the camera streams
+        wanted = self.preroll_settings is not None
+        if self.preroll is not None and not wanted:
+            self.preroll.close()
+            self.preroll = None
+        elif self.preroll is None and wanted:
+            self.preroll = JpegPreRoll(self, *self.preroll_settings)
+
+    def add_callback(self, callback, policy="latest", max_frames=1, frame_rate=None, timestamps=False):
+        subscriber = self.frame_bus.subscribe(callback, policy=policy, max_frames=max_frames, frame_rate=frame_rate, timestamps=timestamps)
+
+        self.metrics.histograms[f"subscriber {subscriber.name}"] = subscriber.callback_time
+        self.metrics.add_counter(f"subscriber {subscriber.name} dropped", lambda: subscriber.dropped)
+
+        return subscriber
+
+    def remove_callback(self, subscriber, drain=True):
+        self.frame_bus.unsubscribe(subscriber, drain=drain)
+
+    def get_subscriber_stats(self):
+        return self.frame_bus.get_stats()
+
+class StreamPipeline(FrameSource):
+    def __init__(self, port = 5601, profile=DEFAULT_PROFILE):
+        super().__init__(port)
+        self.pipeline = None
+        self.pull_thread = None
+        self.stop_event = threading.Event()
+
+        self.network_jitter = self.metrics.histogram("depay jitter")
+        self.decode_latency = self.metrics.histogram("depay -> decode")
+        self.sink_latency = self.metrics.histogram("decode -> appsink")
+        self.pipeline_latency = self.metrics.histogram("depay -> appsink")
+        self.sample_time = self.metrics.histogram("appsink callback")
+        self.received_rate = self.metrics.rate("received fps")
+
+        # buffer arrival times keyed by pts, matched up again further down the pipeline
+        self.depayed_times = {}
+        self.decoded_times = {}
+        self.last_depayed = None
+
+        # the parsed access units passthrough recordings are made of, without a pre-roll it holds just the
+        # current group of pictures so a recording can still start on a keyframe
+        self.h264_preroll = PreRoll(0)
+        self.metrics.add_counter("H.264 pre-roll MB", lambda: self.h264_preroll.size / 2 ** 20)
+
+        self.set_profile(profile)
+
+    def supports_passthrough(self):
+        return PROFILES[self.profile]["codec"] == "H264"
+
+    def enable_preroll(self, seconds=30, max_bytes=256 * 2 ** 20, frame_rate=30):
+        super().enable_preroll(seconds, max_bytes, frame_rate)
+
+        # the encoded stream costs nothing to keep for longer
+        self.h264_preroll.seconds = seconds
+        self.h264_preroll.max_bytes = max_bytes
+
+    def update_preroll(self):
+        # a JPEG stream's frames are kept as they arrive, so nothing is ever encoded for the pre-roll, an H.264
+        # stream's pre-roll is its access units, which is why panels record it through passthrough by default
+        if self.preroll_settings is None or PROFILES[self.profile]["codec"] != "JPEG":
+            self.preroll = None
+        elif self.preroll is None:
+            seconds, max_bytes, _ = self.preroll_settings
+            self.preroll = PreRoll(seconds, max_bytes)
+
+    def set_profile(self, profile):
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown pipeline profile {profile}")
+
+        if self.pipeline is not None:
+            for callback in list(self.rebuild_callbacks):
+                callback()
+            self.stop_pipeline()
+
+        self.profile = profile
+        self.depayed_times = {}
+        self.decoded_times = {}
+        self.last_depayed = None
+        self.update_preroll()
+
+        self.pipeline = Gst.parse_launch(build_pipeline_description(self.port, profile))
+        self.sink = self.pipeline.get_by_name("sink")
+
+        # timestamps start over with a new pipeline, so does the pre-roll
+        self.h264_preroll.clear()
+        parse = self.pipeline.get_by_name("parse")
+        if parse is not None:
+            parse.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self.on_parsed)
+        self.pipeline.get_by_name("depay").get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self.on_depayed)
+        if PROFILES[profile]["codec"] == "JPEG":
+            self.pipeline.get_by_name("depay").get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self.on_jpeg_depayed)
+        self.pipeline.get_by_name("decoder").get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, self.on_decoded)
+
+        if PROFILES[profile]["pull_thread"]:
+            # pulling from our own thread skips the signal marshalling into python on every sample
+            self.stop_event.clear()
+            self.pull_thread = threading.Thread(target=self.pull_samples, args=(self.sink,), daemon=True)
+            self.pull_thread.start()
+        else:
+            self.sink.connect("new-sample", self.on_new_sample, None)
+
+        self.pipeline.set_state(Gst.State.PLAYING)
+
+    def stop_pipeline(self):
+        self.stop_event.set()
+        if self.pull_thread is not None:
+            self.pull_thread.join()
+            self.pull_thread = None
+
+        self.pipeline.set_state(Gst.State.NULL)
+
+    def pull_samples(self, sink):
+        while not self.stop_event.is_set():
+            sample = sink.emit("try-pull-sample", Gst.SECOND // 10)
+            if sample is not None:
+                self.handle_sample(sample)
+
+    def close(self):
+        self.stop_pipeline()
+        self.frame_bus.close()
+
+    def on_depayed(self, pad, info):
+        now = time.perf_counter()
+        pts = info.get_buffer().pts
+        if pts == Gst.CLOCK_TIME_NONE:
+            return Gst.PadProbeReturn.OK
+
+        # a frame can be split over several nal units, only the first one counts as its arrival
+        if pts not in self.depayed_times:
+            if len(self.depayed_times) > 256:
+                self.depayed_times.clear()
+            self.depayed_times[pts] = now
+
+            if self.last_depayed is not None:
+                last_pts, last_time = self.last_depayed
+                self.network_jitter.record(abs((now - last_time) - (pts - last_pts) / Gst.SECOND))
+            self.last_depayed = (pts, now)
+
+        return Gst.PadProbeReturn.OK
+
+    def on_parsed(self, pad, info):
+        preroll = self.h264_preroll
+        if preroll.caps is None:
+            preroll.caps = pad.get_current_caps().to_string()
+
+        buffer = info.get_buffer()
+        preroll.append(PreRollEntry(
+            time.monotonic(),
+            not buffer.has_flags(Gst.BufferFlags.DELTA_UNIT),
+            buffer.extract_dup(0, buffer.get_size()),
+            buffer.pts,
+            buffer.dts,
+        ))
+
+        return Gst.PadProbeReturn.OK
+
+    def on_jpeg_depayed(self, pad, info):
+        preroll = self.preroll
+        if preroll is None:
+            return Gst.PadProbeReturn.OK
+
+        buffer = info.get_buffer()
+        preroll.append(PreRollEntry(time.monotonic(), True, buffer.extract_dup(0, buffer.get_size()), buffer.pts, buffer.dts))
+        return Gst.PadProbeReturn.OK
+
+    def on_decoded(self, pad, info):
+        now = time.perf_counter()
+        pts = info.get_buffer().pts
+
+        depayed = self.depayed_times.pop(pts, None)
+        if depayed is not None:
+            self.decode_latency.record(now - depayed)
+            if len(self.decoded_times) > 256:
+                self.decoded_times.clear()
+            self.decoded_times[pts] = (depayed, now)
+
+        return Gst.PadProbeReturn.OK
+
+    def on_new_sample(self, sink, _):
+        return self.handle_sample(sink.emit("pull-sample"))
+
+    def handle_sample(self, sample):
+        start = time.perf_counter()
+        self.received_rate.tick(start)
+
+        caps = sample.get_caps()
+        buffer = sample.get_buffer()
+
+        decoded = self.decoded_times.pop(buffer.pts, None)
+        if decoded is not None:
+            depayed, decoded = decoded
+            self.sink_latency.record(start - decoded)
+            self.pipeline_latency.record(start - depayed)
+
+        width = caps.get_structure(0).get_value("width")
+        height = caps.get_structure(0).get_value("height")
+        
+        success, map_info = buffer.map(Gst.MapFlags.READ)
+        if not success:
+            print("Failed to map buffer")
+            return Gst.FlowReturn.ERROR
+
+        # udpsrc stamps buffers with their arrival on the pipeline clock, the system clock every pipeline on
+        # this machine shares, so base time + pts lines frames up across cameras and worker processes
+        timestamp = None
+        if buffer.pts != Gst.CLOCK_TIME_NONE:
+            timestamp = self.pipeline.get_base_time() + buffer.pts
+
+        try:
+            self.deliver(np.ndarray((height, width, 4), buffer=map_info.data, dtype=np.uint8), timestamp)
+        finally:
+            buffer.unmap(map_info)
+
+        self.sample_time.record(time.perf_counter() - start)
+        return Gst.FlowReturn.OK
+
+    def deliver(self, mapped, timestamp=None):
+        # copy once so the buffer can go straight back to GStreamer, then share the copy read-only
+        frame = mapped.copy()
+        frame.flags.writeable = False
+
+        self.set_latest_frame(self.latest_frame[0] + 1, frame)
+        self.frame_bus.publish(frame, timestamp)
@@ -0,0 +1,178 @@
+import collections
+import csv
+import os
+import threading
+import time
+import cv2
+
+from metrics import Metrics
+
+INDEX_FIELDS = ("set", "camera", "path", "timestamp_ns", "skew_ms")
+
+class SyncCapture():
+    # writes frames from several cameras as matched sets, paired by capture time within a skew tolerance
+    def __init__(self, cameras, output_dir, frame_rate=10, tolerance=0.010, max_frames=30, quality=95, on_set=None):
+        self.cameras = cameras
+        self.output_dir = output_dir
+        self.set_interval_ns = int(1e9 / frame_rate) if frame_rate else 0
+        self.next_set_time = 0
+        self.tolerance_ns = int(tolerance * 1e9)
+        self.max_frames = max_frames
+        self.params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        # called with [(path, bgr frame)] in camera order for every set written, e.g. to feed a stitcher
+        self.on_set = on_set
+        self.on_close = None
+
+        self.metrics = Metrics("Sync capture")
+        self.skew = self.metrics.histogram("set skew")
+        self.write_time = self.metrics.histogram("set write")
+        self.set_rate = self.metrics.rate("sets")
+        self.sets_written = 0
+        self.unmatched = 0
+        self.untimed = 0
+        self.metrics.add_counter("sets written", lambda: self.sets_written)
+        self.metrics.add_counter("unmatched frames", lambda: self.unmatched)
+        self.metrics.add_counter("frames without timestamp", lambda: self.untimed)
+
+        # (timestamp, frame) per camera, oldest first
+        self.pending = [collections.deque() for _ in cameras]
+        self.lock = threading.Lock()
+        self.index_lock = threading.Lock()
+        self.index_file = None
+        self.index = None
+
+        self.subscribers = []
+        self.recording = False
+        self.closed = 0
+        self.finished = threading.Event()
+
+    def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.index_file = open(os.path.join(self.output_dir, "index.csv"), "w", newline="")
+        self.index = csv.DictWriter(self.index_file, fieldnames=INDEX_FIELDS)
+        self.index.writeheader()
+
+        for i, camera in enumerate(self.cameras):
+            # every frame reaches the matcher, decimating each camera on its own would pick different moments
+            subscriber = camera.add_callback(
+                lambda frame, timestamp, i=i: self.on_new_frame(i, frame, timestamp),
+                policy="queue",
+                max_frames=self.max_frames,
+                timestamps=True
+            )
+            subscriber.on_close = self.on_subscriber_closed
+            self.subscribers.append(subscriber)
+        self.recording = True
+
+    def stop(self):
+        # returns straight away, queued frames are still matched and written before the index is closed
+        if not self.recording:
+            return
+
+        self.recording = False
+        for camera, subscriber in zip(self.cameras, self.subscribers):
+            camera.remove_callback(subscriber, drain=True)
+
+    def is_recording(self):
+        return self.recording
+
+    def is_finished(self):
+        return self.finished.is_set()
+
+    def wait(self, timeout=None):
+        return self.finished.wait(timeout)
+
+    def get_dropped_frames(self):
+        return sum(subscriber.dropped for subscriber in self.subscribers)
+
+    def on_subscriber_closed(self):
+        with self.lock:
+            self.closed += 1
+            if self.closed < len(self.cameras):
+                return
+
+            self.unmatched += sum(len(pending) for pending in self.pending)
+            for pending in self.pending:
+                pending.clear()
+
+        with self.index_lock:
+            self.index_file.close()
+        self.finished.set()
+
+        if self.on_close is not None:
+            self.on_close()
+
+    def on_new_frame(self, camera, frame, timestamp):
+        if timestamp is None:
+            # can't be paired with anything, e.g. a profile whose decoder drops timestamps
+            self.untimed += 1
+            return
+
+        with self.lock:
+            self.pending[camera].append((timestamp, frame))
+            matched = self.match()
+
+        # the slow part happens outside the lock, on whichever camera's thread completed the set
+        for number, frames in matched:
+            self.write_set(number, frames)
+
+    def match(self):
+        matched = []
+        while all(self.pending):
+            timestamps = [pending[0][0] for pending in self.pending]
+            oldest = min(timestamps)
+            if max(timestamps) - oldest <= self.tolerance_ns:
+                frames = [pending.popleft() for pending in self.pending]
+                self.skew.record((max(timestamps) - oldest) / 1e9)
+
+                # the same quarter interval of slack as the frame bus, so arrival jitter doesn't halve the rate
+                if oldest < self.next_set_time - self.set_interval_ns // 4:
+                    continue
+                self.next_set_time = max(self.next_set_time, oldest - self.set_interval_ns // 4) + self.set_interval_ns
+
+                matched.append((self.sets_written, frames))
+                self.sets_written += 1
+                self.set_rate.tick()
+            else:
+                # the oldest frame can only get further from everything that arrives after it
+                self.pending[timestamps.index(oldest)].popleft()
+                self.unmatched += 1
+
+        return matched
+
+    def write_set(self, number, frames):
+        start = time.perf_counter()
+        reference = min(timestamp for timestamp, _ in frames)
+
+        written = []
+        rows = []
+        for i, (timestamp, frame) in enumerate(frames):
+            # numbered so the cameras of a set sit next to each other in frame order
+            path = os.path.join(self.output_dir, f"frame_{number * len(self.cameras) + i + 1}.jpg")
+            bgr = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
+            cv2.imwrite(path, bgr, self.params)
+
+            written.append((path, bgr))
+            rows.append({
+                "set": number,
+                "camera": self.cameras[i].port,
+                "path": os.path.basename(path),
+                "timestamp_ns": timestamp,
+                "skew_ms": f"{(timestamp - reference) / 1e6:.3f}",
+            })
+
+        with self.index_lock:
+            if not self.index_file.closed:
+                self.index.writerows(rows)
+
+        if self.on_set is not None:
+            self.on_set(written)
+
+        self.write_time.record(time.perf_counter() - start)
+
+    def get_summary(self):
+        return (
+            f"{self.sets_written} sets, {self.set_rate.get_rate(2.0):.1f} sets/s, "
+            f"skew p50 {1000 * self.skew.percentile(50):.1f} ms p99 {1000 * self.skew.percentile(99):.1f} ms, "
+            f"{self.unmatched} unmatched, {self.get_dropped_frames()} dropped"
+        )